@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+# Measure how fast the NAL splitter can split a recorded H.264 stream into
+# frames. Pass the path of a recorded .h264 file. Otherwise, a synthetic
+# stream roughly the size of the 1296x976@24 navigation camera stream is
+# generated. The stream is fed to the splitter in 1 KB chunks, the same way it
+# arrives over HTTP.
+
+import random
+import sys
+import time
+from nal_splitter import NALSplitter, AccessUnitAssembler
+
+
+CHUNK_SIZE = 1024
+FRAMES_PER_SECOND = 24
+SECONDS = 60
+
+# a typical bitrate for the camera stream, in bytes per second
+BYTES_PER_SECOND = 2000000
+
+
+def make_nal(header, size):
+    # NAL payloads never contain two zero bytes in a row, so keep zeros out of
+    # the random data
+    payload = bytes(random.randrange(1, 256) for i in range(257))
+    body = (payload * (size // len(payload) + 1))[:size]
+
+    return b"\x00\x00\x00\x01" + bytes(header) + body
+
+
+def make_stream():
+    random.seed(1234)
+    frame_size = BYTES_PER_SECOND // FRAMES_PER_SECOND
+    parameters = make_nal((0x67, 0x64), 20) + make_nal((0x68, 0xee), 4)
+    keyframe = parameters + make_nal((0x65, 0x88), frame_size * 4)
+    frame = make_nal((0x41, 0x9a), frame_size)
+    frames = []
+
+    for i in range(FRAMES_PER_SECOND * SECONDS):
+        frames.append(keyframe if i % FRAMES_PER_SECOND == 0 else frame)
+
+    return b"".join(frames)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], "rb") as f:
+            data = f.read()
+    else:
+        data = make_stream()
+
+    splitter = NALSplitter()
+    assembler = AccessUnitAssembler()
+    nal_count = 0
+    frame_count = 0
+
+    start = time.perf_counter()
+
+    for offset in range(0, len(data), CHUNK_SIZE):
+        for nal in splitter.feed(data[offset:offset + CHUNK_SIZE]):
+            nal_count += 1
+            if assembler.add(nal) is not None:
+                frame_count += 1
+
+    for nal in splitter.flush():
+        nal_count += 1
+        if assembler.add(nal) is not None:
+            frame_count += 1
+
+    if assembler.flush() is not None:
+        frame_count += 1
+
+    elapsed = time.perf_counter() - start
+    video_seconds = frame_count / float(FRAMES_PER_SECOND)
+
+    print("bytes             =", len(data))
+    print("nal units         =", nal_count)
+    print("frames            =", frame_count)
+    print("MB/s              = {:.1f}".format(len(data) / elapsed / 1000000.0))
+    print("frames/s          = {:.0f}".format(frame_count / elapsed))
+    print("cpu % at 24 fps   = {:.2f}".format(100.0 * elapsed / video_seconds))
@@ -1,43 +1,33 @@
 #!/usr/bin/env python3
 import requests
+from nal_splitter import NALSplitter, AccessUnitAssembler
+
+FRAME_COUNT = 120
 
 frames = []
-data = b""
-found_first = False
+splitter = NALSplitter()
+assembler = AccessUnitAssembler()
 response = requests.get("http://navigation.local:8080/stream/video.h264", stream=True)
 
 for chunk in response.iter_content(chunk_size=1024):
     if chunk:
-        starting_offset = len(data)
-
-        if starting_offset >= 2:
-            if data[-1] == b"\x00":
-                print("last byte is zero, backing up one")
-                starting_offset -= 1
-            if data[-2] == b"\x00":
-                print("second to last byte is zero, backing up one more")
-                starting_offset -= 1
-
-        data = data + chunk
-        offset = data.find(b"\x00\x00\x01", starting_offset)
+        for nal in splitter.feed(chunk):
+            access_unit = assembler.add(nal)
 
-        if offset != -1:
-            print("found frame")
-            remaining = data[offset:]
+            if access_unit is not None:
+                (keyframe, nals) = access_unit
 
-            if not found_first:
-                print("dropping partial first frame")
-                found_first = True
-            else:
-                print("adding frame", len(frames) + 1)
-                frames.append(data[:offset])
-                
-                if len(frames) == 120:
-                    break
+                # we can only decode from a keyframe, so drop any partial
+                # frames before the first one
+                if len(frames) == 0 and not keyframe:
+                    print("dropping frame before first keyframe")
+                else:
+                    print("adding frame", len(frames) + 1)
+                    frames.append(b"".join(nals))
 
-            data = remaining
+        if len(frames) >= FRAME_COUNT:
+            break
 
 with open("navigation.h264", "wb") as out:
-    out.write(b"\x00")
-    for frame in frames:
+    for frame in frames[:FRAME_COUNT]:
         out.write(frame)
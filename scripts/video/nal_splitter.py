@@ -0,0 +1,148 @@
+START_CODE = b"\x00\x00\x01"
+
+# NAL unit types we care about. See section 7.4.1 of the H.264 spec
+NON_IDR_SLICE = 1
+IDR_SLICE = 5
+SEI = 6
+SPS = 7
+PPS = 8
+ACCESS_UNIT_DELIMITER = 9
+
+
+def nal_type(nal):
+    '''
+    Return the type of a NAL unit that starts with a 3 or 4 byte start code
+    '''
+    header = 3 if nal[2] == 1 else 4
+
+    return nal[header] & 0x1F
+
+
+def first_slice_in_picture(nal):
+    '''
+    A slice begins a new picture when its first_mb_in_slice is zero. That
+    value is the first field of the slice header and is Exp-Golomb coded, so
+    it is zero exactly when the first bit after the NAL header is set.
+    '''
+    header = 3 if nal[2] == 1 else 4
+
+    return len(nal) > header + 1 and (nal[header + 1] & 0x80) != 0
+
+
+class NALSplitter:
+    '''
+    Splits an H.264 Annex B byte stream into NAL units as chunks arrive.
+
+    Incoming chunks are appended to one reusable bytearray and we only search
+    the bytes that have not been searched before, backing up two bytes so a
+    start code split across chunks is still found. Each NAL unit is copied out
+    of the buffer exactly once, including its start code, so writing the
+    units back to back reproduces the stream. Bytes before the first start
+    code are a partial unit and are dropped.
+    '''
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.start = -1
+        self.searched = 0
+
+    def feed(self, chunk):
+        buffer = self.buffer
+        buffer.extend(chunk)
+        position = max(0, self.searched - 2)
+        units = []
+
+        with memoryview(buffer) as view:
+            while True:
+                found = buffer.find(START_CODE, position)
+
+                if found == -1:
+                    break
+
+                # a 4 byte start code has an extra leading zero
+                begin = found - 1 if found > 0 and buffer[found - 1] == 0 else found
+
+                if self.start != -1 and begin > self.start:
+                    units.append(view[self.start:begin].tobytes())
+
+                self.start = begin
+                position = found + 3
+
+        # drop everything we have already handed out, or everything if we
+        # have not seen a start code yet
+        consumed = self.start if self.start != -1 else max(0, len(buffer) - 3)
+
+        if consumed > 0:
+            del buffer[:consumed]
+
+            if self.start != -1:
+                self.start = 0
+
+        self.searched = len(buffer)
+
+        return units
+
+    def flush(self):
+        '''
+        Return the last NAL unit once the stream has ended
+        '''
+        if self.start == -1 or len(self.buffer) == 0:
+            return []
+
+        unit = bytes(self.buffer[self.start:])
+        self.buffer = bytearray()
+        self.start = -1
+        self.searched = 0
+
+        return [unit]
+
+
+class AccessUnitAssembler:
+    '''
+    Groups NAL units into access units, which are complete frames. A new
+    access unit starts with an access unit delimiter, SPS, PPS or SEI that
+    follows a slice, or with a slice that is the first slice of a picture.
+    Access units are returned as (keyframe, list of NAL units) pairs, where a
+    keyframe contains an IDR slice.
+    '''
+
+    def __init__(self):
+        self.nals = []
+        self.has_slice = False
+        self.keyframe = False
+
+    def add(self, nal):
+        '''
+        Add a NAL unit. Returns the previous access unit if this NAL unit
+        starts a new one, otherwise None.
+        '''
+        completed = None
+        kind = nal_type(nal)
+
+        if kind == NON_IDR_SLICE or kind == IDR_SLICE:
+            if self.has_slice and first_slice_in_picture(nal):
+                completed = self.flush()
+            self.has_slice = True
+            self.keyframe = self.keyframe or kind == IDR_SLICE
+        elif SEI <= kind <= ACCESS_UNIT_DELIMITER:
+            if self.has_slice:
+                completed = self.flush()
+
+        self.nals.append(nal)
+
+        return completed
+
+    def flush(self):
+        if len(self.nals) == 0:
+            return None
+
+        access_unit = (self.keyframe, self.nals)
+        self.nals = []
+        self.has_slice = False
+        self.keyframe = False
+
+        return access_unit
+
+
+if __name__ == "__main__":
+    pass
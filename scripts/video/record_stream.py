@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+
+# Continuously record the navigation camera's H.264 stream into segment files
+# with a frame index. If the stream drops, we reconnect and keep recording.
+
+import sys
+import time
+import requests
+from nal_splitter import NALSplitter, AccessUnitAssembler
+from segment_recorder import SegmentRecorder
+
+
+URL = "http://navigation.local:8080/stream/video.h264"
+DIRECTORY = "recordings"
+SEGMENT_SECONDS = 60.0
+RECONNECT_DELAY = 2.0
+
+# process command line args
+for i in range(1, len(sys.argv)):
+    arg = sys.argv[i]
+
+    if arg == "-u" or arg == "--url":
+        URL = sys.argv[i + 1]
+    elif arg == "-d" or arg == "--directory":
+        DIRECTORY = sys.argv[i + 1]
+    elif arg == "-s" or arg == "--segment-seconds":
+        SEGMENT_SECONDS = float(sys.argv[i + 1])
+
+
+def record(recorder):
+    splitter = NALSplitter()
+    assembler = AccessUnitAssembler()
+    response = requests.get(URL, stream=True, timeout=10)
+
+    # close the connection however recording stops, including Ctrl-C
+    try:
+        for chunk in response.iter_content(chunk_size=4096):
+            if chunk:
+                for nal in splitter.feed(chunk):
+                    access_unit = assembler.add(nal)
+
+                    if access_unit is not None:
+                        (keyframe, nals) = access_unit
+                        recorder.add(keyframe, nals)
+    finally:
+        response.close()
+
+
+recorder = SegmentRecorder(DIRECTORY, segment_seconds=SEGMENT_SECONDS)
+
+try:
+    while True:
+        try:
+            record(recorder)
+            print("stream ended, reconnecting")
+        except requests.exceptions.RequestException as e:
+            print("stream error, reconnecting:", e)
+
+        # a new connection starts with a partial frame, so always start a new
+        # segment at the next keyframe
+        recorder.close()
+        time.sleep(RECONNECT_DELAY)
+except KeyboardInterrupt:
+    recorder.close()
@@ -0,0 +1,208 @@
+import os
+import struct
+import time
+from bisect import bisect_right
+
+
+# An index starts with a header holding a magic number and the wall clock
+# time the segment started, in seconds since the epoch
+INDEX_MAGIC = b"SEGIDX02"
+INDEX_HEADER = struct.Struct("<8sd")
+
+# Each frame in a segment has one fixed size index record: the byte offset of
+# the frame in the segment file, its size in bytes, the time it arrived in
+# seconds since the segment started, and whether it is a keyframe. Frame times
+# come from the monotonic clock, so they always increase, even if the wall
+# clock is changed during the segment
+INDEX_RECORD = struct.Struct("<QIdB")
+
+
+class SegmentRecorder:
+    '''
+    Writes frames straight to a series of segment files, starting a new
+    segment at the first keyframe after segment_seconds have passed. Every
+    segment starts with a keyframe, so it can be played on its own. Next to
+    each segment we write an index of all of its frames.
+
+    Frames are written as soon as they arrive, so memory use does not grow
+    with the length of the recording.
+
+    Segments are rotated and frames are timed using the monotonic clock, so a
+    clock change, for example when NTP syncs after boot, can't cut a segment
+    short, make it run on, or put its frames out of order. The wall clock is
+    only read once per segment, for its name and start time.
+    '''
+
+    def __init__(self, directory, prefix="navigation", segment_seconds=60.0):
+        self.directory = directory
+        self.prefix = prefix
+        self.segment_seconds = segment_seconds
+        self.segment = None
+        self.index = None
+        self.segment_started = None
+        self.offset = 0
+
+        os.makedirs(directory, exist_ok=True)
+
+    def add(self, keyframe, nals, now=None):
+        '''
+        Add one frame, given as a list of NAL units. Frames before the first
+        keyframe can't be decoded, so they are dropped. now is the monotonic
+        time the frame arrived.
+        '''
+        if now is None:
+            now = time.monotonic()
+
+        if keyframe:
+            if self.segment is None or now - self.segment_started >= self.segment_seconds:
+                self.open_segment(time.time(), now)
+        elif self.segment is None:
+            return False
+
+        size = 0
+
+        for nal in nals:
+            self.segment.write(nal)
+            size += len(nal)
+
+        self.index.write(INDEX_RECORD.pack(self.offset, size, now - self.segment_started, 1 if keyframe else 0))
+        self.offset += size
+
+        return True
+
+    def open_segment(self, timestamp, now):
+        self.close()
+
+        # names include milliseconds, but the clock may have been set back
+        # or segments may be very short, so never overwrite an existing
+        # segment. Instead, add a sequence number to the name
+        name = "{}-{}-{:03d}".format(
+            self.prefix,
+            time.strftime("%Y%m%d-%H%M%S", time.localtime(timestamp)),
+            int(timestamp * 1000) % 1000
+        )
+        sequence = 0
+
+        while True:
+            path = os.path.join(self.directory, name if sequence == 0 else "{}-{}".format(name, sequence))
+
+            try:
+                self.segment = open(path + ".h264", "xb")
+                break
+            except FileExistsError:
+                sequence += 1
+
+        print("starting segment", path + ".h264")
+
+        # the index belongs to the segment we just created, so anything left
+        # under its name is stale
+        self.index = open(path + ".idx", "wb")
+        self.index.write(INDEX_HEADER.pack(INDEX_MAGIC, timestamp))
+        self.segment_started = now
+        self.offset = 0
+
+    def close(self):
+        if self.segment is not None:
+            self.segment.close()
+            self.index.close()
+            self.segment = None
+            self.index = None
+
+
+class SegmentReader:
+    '''
+    Random access to the frames of a recorded segment using its index, without
+    scanning the segment itself.
+
+    Times are given in seconds since the epoch. Frame times are the start
+    time of the segment plus the time since the segment started, so they are
+    in order even if the wall clock changed while recording.
+    '''
+
+    def __init__(self, path):
+        base = os.path.splitext(path)[0]
+
+        self.path = base + ".h264"
+
+        with open(base + ".idx", "rb") as f:
+            header = f.read(INDEX_HEADER.size)
+            data = f.read()
+
+        if len(header) < INDEX_HEADER.size:
+            raise ValueError("Not a segment index: " + base + ".idx")
+
+        (magic, self.start_time) = INDEX_HEADER.unpack(header)
+
+        if magic != INDEX_MAGIC:
+            raise ValueError("Not a segment index: " + base + ".idx")
+
+        # a recording that was interrupted may have a partial last record
+        usable = len(data) - len(data) % INDEX_RECORD.size
+
+        self.offsets = []
+        self.sizes = []
+        self.times = []
+        self.keyframes = []
+
+        for (offset, size, elapsed, keyframe) in INDEX_RECORD.iter_unpack(data[:usable]):
+            self.offsets.append(offset)
+            self.sizes.append(size)
+            self.times.append(elapsed)
+            if keyframe:
+                self.keyframes.append(len(self.offsets) - 1)
+
+    def timestamp(self, frame):
+        '''
+        Return the time a frame arrived
+        '''
+        return self.start_time + self.times[frame]
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def frame_at(self, timestamp):
+        '''
+        Return the number of the last frame at or before timestamp
+        '''
+        return max(0, bisect_right(self.times, timestamp - self.start_time) - 1)
+
+    def keyframe_before(self, frame):
+        '''
+        Return the number of the last keyframe at or before a frame. Decoding
+        has to start there.
+        '''
+        position = bisect_right(self.keyframes, frame) - 1
+
+        return self.keyframes[max(0, position)]
+
+    def read_frames(self, first, last):
+        '''
+        Return the bytes of frames first through last, inclusive, with a single
+        read. Frames are stored back to back, so this is one contiguous range.
+        '''
+        start = self.offsets[first]
+        end = self.offsets[last] + self.sizes[last]
+
+        with open(self.path, "rb") as f:
+            f.seek(start)
+            return f.read(end - start)
+
+    def extract_clip(self, start_time, end_time, out):
+        '''
+        Write a playable clip covering start_time through end_time to an open
+        file. The clip begins at the keyframe before start_time.
+        '''
+        first = self.keyframe_before(self.frame_at(start_time))
+        last = self.frame_at(end_time)
+
+        if last < first:
+            return 0
+
+        data = self.read_frames(first, last)
+        out.write(data)
+
+        return last - first + 1
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+
+# Measure how many NMEA sentences per second the parser can process. Pass the
+# path of a recorded NMEA log to use real data. Otherwise, a log is built by
+# repeating the example sentences from the GPS documentation.
+
+import io
+import sys
+import time
+from nmea import NMEAParser, read_records
+
+
+EXAMPLE_SENTENCES = b"""$GPGGA,003907.000,4741.0757,N,11647.1921,W,2,08,1.10,670.1,M,-16.9,M,0000,0000*56\r
+$GPGSA,A,3,19,24,17,02,29,12,05,25,06,,,,1.49,0.96,1.13*04\r
+$GPRMC,003758.000,A,4741.0717,N,11647.1868,W,0.26,151.76,080517,,,D*7E\r
+$GPVTG,305.74,T,,M,0.03,N,0.05,K,D*3B\r
+$GPGSV,3,1,11,12,83,219,41,02,77,169,36,06,48,057,27,25,43,306,26*79\r
+$GPGSV,3,2,11,48,33,201,35,19,24,079,24,24,21,216,27,29,15,271,30*7A\r
+$GPGSV,3,3,11,05,13,158,33,17,07,084,23,31,06,333,18*40\r
+"""
+REPEAT = 30000
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], "rb") as f:
+            data = f.read()
+    else:
+        data = EXAMPLE_SENTENCES * REPEAT
+
+    parser = NMEAParser()
+    start = time.perf_counter()
+    records = sum(1 for record in read_records(io.BytesIO(data), parser))
+    elapsed = time.perf_counter() - start
+
+    print("bytes        =", len(data))
+    print("sentences    =", parser.sentences)
+    print("records      =", records)
+    print("invalid      =", parser.invalid)
+    print("unknown      =", parser.unknown)
+    print("sentences/s  = {:.0f}".format(parser.sentences / elapsed))
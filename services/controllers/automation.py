@@ -0,0 +1,263 @@
+import math
+import time
+from bisect import bisect_right
+from contextlib import contextmanager
+from input_types import BUTTON, AUTOMATION
+from utils import lerp
+
+
+# Values are rounded to this many decimal places before we decide whether
+# they changed. This matches the precision the thruster server uses, so we
+# never send a value the server would treat as unchanged.
+PRECISION = 3
+
+# The default number of times per second we evaluate the schedule
+DEFAULT_RATE = 200
+
+# time.sleep can wake up late, so we sleep until this many seconds before a
+# deadline and wait out the rest in a loop
+SPIN_TIME = 0.0005
+
+
+class Track:
+    '''
+    The values of a single axis or motor over time, made of segments that
+    each ramp from one value to another. Between segments the track holds the
+    value the previous segment ended on. Before the first segment the track
+    has no value, so nothing is sent for it.
+    '''
+
+    def __init__(self):
+        self.starts = []
+        self.segments = []
+
+    def add(self, start, duration, from_value, to_value):
+        position = bisect_right(self.starts, start)
+        self.starts.insert(position, start)
+        self.segments.insert(position, (start, duration, from_value, to_value))
+
+    @property
+    def end(self):
+        return max([start + duration for (start, duration, a, b) in self.segments] or [0.0])
+
+    def value_at(self, t):
+        position = bisect_right(self.starts, t) - 1
+
+        if position < 0:
+            return None
+
+        (start, duration, from_value, to_value) = self.segments[position]
+
+        if duration <= 0.0 or t >= start + duration:
+            return to_value
+
+        return lerp(from_value, to_value, (t - start) / duration)
+
+
+class Schedule:
+    '''
+    A script of ramps, holds and button presses laid out on a timeline.
+
+    Adding a ramp or a button press places it at the current cursor time and
+    moves the cursor to its end, and hold moves the cursor forward. Inside of
+    a together block, everything starts at the same time and the cursor moves
+    to the end of the longest item when the block exits, so several axes can
+    ramp at once. Inside of a branch block, everything runs one after another
+    again, even within a together block. Several branches in a together block
+    run side by side, and the together block ends with the longest branch.
+
+    Nothing is sent while building a schedule. frames turns it into the list
+    of changes to send at each tick, which a Player then sends on time.
+    '''
+
+    def __init__(self):
+        self.tracks = {}
+        self.buttons = []
+        self.cursor = 0.0
+        self.group = None
+
+    @property
+    def duration(self):
+        ends = [track.end for track in self.tracks.values()]
+        ends.extend(t for (t, index, value) in self.buttons)
+
+        return max(ends + [self.cursor])
+
+    def advance(self, end):
+        if self.group is None:
+            self.cursor = end
+        else:
+            self.group[1] = max(self.group[1], end)
+
+    def start_time(self):
+        return self.cursor if self.group is None else self.group[0]
+
+    def ramp(self, type, index, from_value, to_value, duration):
+        start = self.start_time()
+
+        self.tracks.setdefault((type, index), Track()).add(start, duration, from_value, to_value)
+        self.advance(start + duration)
+
+    def set(self, type, index, value):
+        self.ramp(type, index, value, value, 0.0)
+
+    def hold(self, seconds):
+        if self.group is None:
+            self.cursor += seconds
+        else:
+            self.advance(self.group[0] + seconds)
+
+    def button(self, index, value):
+        self.buttons.append((self.start_time(), index, value))
+
+    @contextmanager
+    def together(self):
+        outer = self.group
+        self.group = [self.start_time(), self.start_time()]
+
+        try:
+            yield self
+        finally:
+            end = self.group[1]
+            self.group = outer
+            self.advance(end)
+
+    @contextmanager
+    def branch(self):
+        outer = (self.cursor, self.group)
+        self.cursor = self.start_time()
+        self.group = None
+
+        try:
+            yield self
+        finally:
+            end = self.cursor
+            (self.cursor, self.group) = outer
+            self.advance(end)
+
+    def frames(self, rate=DEFAULT_RATE):
+        '''
+        Yield (time, changes) for every tick at the given rate where something
+        changes. changes is a list of (type, index, value). Only values that
+        differ from the last value sent for the same axis or motor are
+        included. The last tick falls exactly on the end of the schedule so
+        every ramp finishes on its final value, and it is always yielded, even
+        without changes, so a schedule that ends with a hold is held until
+        the end.
+        '''
+        duration = self.duration
+        count = int(math.ceil(duration * rate))
+        buttons = sorted(self.buttons, key=lambda button: button[0])
+        next_button = 0
+        last = {}
+
+        for tick in range(count + 1):
+            t = min(tick / float(rate), duration)
+            changes = []
+
+            while next_button < len(buttons) and buttons[next_button][0] <= t:
+                (button_time, index, value) = buttons[next_button]
+                changes.append((BUTTON, index, value))
+                next_button += 1
+
+            for (key, track) in self.tracks.items():
+                value = track.value_at(t)
+
+                if value is None:
+                    continue
+
+                value = round(value, PRECISION)
+
+                if last.get(key) != value:
+                    last[key] = value
+                    changes.append((key[0], key[1], value))
+
+            if changes or tick == count:
+                yield (t, changes)
+
+
+class Player:
+    '''
+    Sends the frames of a schedule over a ThrusterConnection on time.
+
+    Every frame has an absolute deadline measured from the start on the
+    monotonic clock, so time spent sending never pushes later frames back and
+    the playback does not drift. If we do fall behind, for example when the
+    network stalls, all frames that are due are merged and sent at once with
+    the latest value of each axis.
+    '''
+
+    def __init__(self, connection, controller=AUTOMATION, verbose=False):
+        self.connection = connection
+        self.controller = controller
+        self.verbose = verbose
+
+        # how late each frame was sent, in seconds
+        self.lateness = []
+        self.messages_sent = 0
+
+    def play(self, frames):
+        frames = iter(frames)
+        start = time.monotonic()
+        frame = next(frames, None)
+
+        while frame is not None:
+            deadline = start + frame[0]
+            self.wait_until(deadline)
+
+            # collect every frame that is due by now
+            due = {}
+            buttons = []
+
+            while frame is not None and start + frame[0] <= time.monotonic():
+                for (type, index, value) in frame[1]:
+                    if type == BUTTON:
+                        buttons.append((type, index, value))
+                    else:
+                        due[(type, index)] = value
+
+                frame = next(frames, None)
+
+            changes = buttons + [(type, index, value) for ((type, index), value) in due.items()]
+
+            if changes:
+                self.lateness.append(time.monotonic() - deadline)
+                self.send(changes)
+
+        if self.connection.pipelined:
+            self.connection.flush()
+
+    def wait_until(self, deadline):
+        delay = deadline - time.monotonic()
+
+        if delay > SPIN_TIME:
+            time.sleep(delay - SPIN_TIME)
+
+        while time.monotonic() < deadline:
+            pass
+
+    def send(self, changes):
+        for (type, index, value) in changes:
+            if self.verbose:
+                print("Setting {} {} to {}".format("button" if type == BUTTON else "axis/motor", index, value))
+
+            self.connection.send(self.controller, type, index, value)
+
+        self.messages_sent += len(changes)
+
+    def report(self):
+        if len(self.lateness) == 0:
+            return "no frames sent"
+
+        lateness = sorted(self.lateness)
+
+        return "messages sent: {}, frames: {}, median lateness: {:.3f} ms, worst lateness: {:.3f} ms".format(
+            self.messages_sent,
+            len(lateness),
+            1000 * lateness[len(lateness) // 2],
+            1000 * lateness[-1]
+        )
+
+
+if __name__ == "__main__":
+    pass
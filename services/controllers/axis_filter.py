@@ -0,0 +1,201 @@
+import os
+import json
+import time
+
+
+# Per-axis filter settings can be stored in this file. Axes are numbered the
+# way the thruster server numbers them (JL_H, JL_V, JR_H, JR_V, AL, AR).
+FILTER_FILE = 'axis_filter.json'
+
+# dead_zone - how far from its resting position an axis has to move before we
+# treat it as moved. Controllers rarely return exactly to rest, so this keeps
+# the thrusters off when the sticks are let go. Values outside the dead zone
+# are rescaled so the output still covers the whole range.
+#
+# hysteresis - once an axis is inside its dead zone, it has to move this much
+# further out before it leaves again. This stops an axis sitting right on the
+# edge of the dead zone from flickering in and out of it.
+#
+# min_delta - the smallest change in the output we bother sending. Reaching
+# the resting position or either end of the range is always sent. A smaller
+# change is held back, and sent once the axis has settled on it. See
+# SETTLE_TIME.
+#
+# rest - where the axis sits when nobody is touching it. The sticks rest at
+# 0.0 and the analog triggers rest at -1.0.
+STICK = {'dead_zone': 0.05, 'hysteresis': 0.02, 'min_delta': 0.02, 'rest': 0.0}
+TRIGGER = {'dead_zone': 0.05, 'hysteresis': 0.02, 'min_delta': 0.02, 'rest': -1.0}
+
+DEFAULT_AXES = {
+    0: STICK,
+    1: STICK,
+    2: STICK,
+    3: STICK,
+    4: TRIGGER,
+    5: TRIGGER
+}
+
+# A value held back because it was within min_delta of the last value sent is
+# sent anyway once the axis has not moved for this many seconds. Without this,
+# a stick moved slowly could stop up to min_delta away from the value the
+# thrusters are using, and stay there for as long as it is held.
+SETTLE_TIME = 0.1
+
+
+class AxisFilter:
+    '''
+    Drops axis values that are only noise. Each axis has a dead zone around
+    its resting position, hysteresis at the edge of the dead zone, and a
+    minimum change required before a new value is passed on. filter returns
+    the value to use, or None when the value should be dropped. Axes we have
+    no settings for are passed through untouched.
+
+    Values held back by min_delta are kept, and settled returns them once
+    their axis has been still for settle_time seconds. Callers should call
+    settled regularly, even when no new values arrive.
+
+    State is kept for each (controller, axis) pair, so several controllers can
+    share one filter.
+
+    Only one side should apply the dead zone. Values that come from a client
+    that already filters have been rescaled past the dead zone once, and
+    doing it again would shrink the range. For those, create the filter with
+    prefiltered set. It then leaves the dead zone and hysteresis to the
+    client and only holds back changes smaller than min_delta.
+    '''
+
+    def __init__(self, axes=None, settle_time=SETTLE_TIME, prefiltered=False):
+        self.axes = DEFAULT_AXES if axes is None else axes
+        self.settle_time = settle_time
+        self.prefiltered = prefiltered
+        self.outputs = {}
+        self.inside = {}
+
+        # the last value that came in for each (controller, axis), before
+        # filtering. A settled value is always the output for this input
+        self.inputs = {}
+
+        # values held back by min_delta and the time they arrived, by
+        # (controller, axis)
+        self.held = {}
+
+        # how many values we passed on and how many we dropped
+        self.passed = 0
+        self.suppressed = 0
+
+    def filter(self, controller, axis, value, now=None):
+        config = self.axes.get(axis)
+
+        if config is None:
+            self.passed += 1
+            return value
+
+        key = (controller, axis)
+        self.inputs[key] = value
+        rest = config['rest']
+        dead_zone = config['dead_zone']
+        offset = value - rest
+        distance = abs(offset)
+
+        if self.prefiltered:
+            # the client already applied the dead zone
+            output = value
+        else:
+            # find out if we're inside the dead zone. Leaving it takes a
+            # little more movement than entering it
+            if self.inside.get(key, True):
+                inside = distance <= dead_zone + config['hysteresis']
+            else:
+                inside = distance <= dead_zone
+
+            self.inside[key] = inside
+
+            if inside:
+                output = rest
+            else:
+                # rescale what's left outside the dead zone to the full range
+                # on this side of the resting position
+                limit = 1.0 - rest if offset > 0 else rest + 1.0
+                scaled = (distance - dead_zone) / (limit - dead_zone) * limit
+                output = rest + min(scaled, limit) * (1.0 if offset > 0 else -1.0)
+
+        last = self.outputs.get(key)
+
+        if last is not None:
+            if output == last:
+                self.held.pop(key, None)
+                self.suppressed += 1
+                return None
+
+            # small changes are held back, unless they take us to rest or to
+            # the end of the range
+            if abs(output - last) < config['min_delta'] and output != rest and abs(output) != 1.0:
+                self.held[key] = (output, time.monotonic() if now is None else now)
+                self.suppressed += 1
+                return None
+
+        self.held.pop(key, None)
+        self.outputs[key] = output
+        self.passed += 1
+
+        return output
+
+    def settled(self, now=None):
+        '''
+        Return (controller, axis, value) for every held back value whose axis
+        has not moved for settle_time seconds. These are treated as sent.
+        '''
+        if not self.held:
+            return []
+
+        if now is None:
+            now = time.monotonic()
+
+        result = []
+
+        for (key, (output, held_time)) in list(self.held.items()):
+            if now - held_time >= self.settle_time:
+                del self.held[key]
+                self.outputs[key] = output
+                self.passed += 1
+                result.append((key[0], key[1], output))
+
+        return result
+
+    def release(self, controller):
+        '''
+        Forget everything about a controller, so its next value is passed on
+        no matter what it was sending before
+        '''
+        for state in (self.outputs, self.inside, self.held, self.inputs):
+            for key in [key for key in state if key[0] == controller]:
+                del state[key]
+
+
+def load_filter(filename=FILTER_FILE, prefiltered=False):
+    '''
+    Create an AxisFilter using the settings in filename if it exists, or the
+    defaults if it does not, passing prefiltered on to it. The file holds an
+    object that maps each axis number to its settings. Settings missing from the file keep their
+    defaults: the trigger defaults for the triggers, the stick defaults for
+    everything else. Axes missing from the file keep all of their defaults.
+    '''
+    if not os.path.isfile(filename):
+        return AxisFilter(prefiltered=prefiltered)
+
+    with open(filename, 'r') as f:
+        data = json.load(f)
+
+    axes = dict(DEFAULT_AXES)
+
+    for (axis, settings) in data.items():
+        axis = int(axis)
+        config = dict(DEFAULT_AXES.get(axis, STICK))
+        config.update(settings)
+        axes[axis] = config
+
+    return AxisFilter(axes, prefiltered=prefiltered)
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+
+# Run simulated stick input through the client's axis filter and then through
+# the server's, the way thruster_client and thruster_server --prefiltered do,
+# and check that filtering on both sides keeps the full range of the sticks.
+# Also report how many frames the filter saves while the sticks rest or are
+# held steady, which should be at least an order of magnitude.
+#
+# No server or controller is needed. Time is simulated, so this runs in a
+# moment.
+
+import random
+import sys
+from axis_filter import AxisFilter
+
+
+EVENT_RATE = 250
+SEED = 1234
+
+# how much a resting or held stick jitters
+NOISE = 0.004
+
+# the axis we move, a stick that rests at 0.0
+AXIS = 1
+CONTROLLER = 0
+
+
+def make_phases():
+    '''
+    A pilot's stick over time as (seconds, start, end) phases. A phase with
+    the same start and end is the stick resting or held steady.
+    '''
+    return [
+        (2.0, 0.0, 0.0),
+        (1.0, 0.0, 1.0),
+        (2.0, 1.0, 1.0),
+        (2.0, 1.0, -1.0),
+        (2.0, -1.0, -1.0),
+        (1.0, -1.0, 0.3),
+        (2.0, 0.3, 0.3),
+        (0.5, 0.3, 0.0),
+        (2.0, 0.0, 0.0)
+    ]
+
+
+def simulate(client, server):
+    '''
+    Returns the number of events, the number of those during steady phases,
+    the frames the client sent during steady phases, and a list of (target,
+    client value, server value) at the end of every steady phase
+    '''
+    random.seed(SEED)
+    period = 1.0 / EVENT_RATE
+    now = 0.0
+    events = 0
+    steady_events = 0
+    steady_sent = 0
+    client_value = None
+    server_value = None
+    holds = []
+
+    def apply(value):
+        nonlocal server_value
+
+        applied = server.filter(CONTROLLER, AXIS, value, now)
+
+        if applied is not None:
+            server_value = applied
+
+    for (seconds, start, end) in make_phases():
+        steady = start == end
+        count = int(seconds * EVENT_RATE)
+
+        for i in range(count):
+            target = start + (end - start) * (i + 1) / count
+            value = max(-1.0, min(target + random.uniform(-NOISE, NOISE), 1.0))
+            sent = []
+
+            output = client.filter(CONTROLLER, AXIS, round(value, 3), now)
+
+            if output is not None:
+                sent.append(output)
+
+            sent.extend(value for (controller, axis, value) in client.settled(now))
+
+            for output in sent:
+                client_value = output
+                apply(round(output, 3))
+
+            for (controller, axis, value) in server.settled(now):
+                server_value = value
+
+            events += 1
+
+            if steady:
+                steady_events += 1
+                steady_sent += len(sent)
+
+            now += period
+
+        if steady:
+            holds.append((end, client_value, server_value))
+
+    return events, steady_events, steady_sent, holds
+
+
+if __name__ == "__main__":
+    failures = []
+
+    (events, steady_events, steady_sent, holds) = simulate(AxisFilter(), AxisFilter(prefiltered=True))
+
+    print("events                 =", events)
+    print("steady events          =", steady_events)
+    print("steady frames sent     =", steady_sent)
+
+    for (target, client_value, server_value) in holds:
+        print("held at {:5.2f}: client sent {:.3f}, server applied {:.3f}".format(target, client_value, server_value))
+
+        # the server must end up on exactly what the client sent
+        if round(client_value, 3) != server_value:
+            failures.append("server applied {} instead of {}".format(server_value, client_value))
+
+    # pushing a stick all the way must still give full thrust
+    for extreme in (1.0, -1.0):
+        if extreme not in [server_value for (target, client_value, server_value) in holds]:
+            failures.append("the server never reached {}".format(extreme))
+
+    # for comparison, applying the dead zone on both sides shrinks every
+    # value between rest and the ends of the range a second time
+    (_, _, _, double_holds) = simulate(AxisFilter(), AxisFilter())
+
+    for ((target, client_value, server_value), (_, _, twice)) in zip(holds, double_holds):
+        if abs(target) not in (0.0, 1.0):
+            print("held at {:5.2f}: filtered twice, server applied {:.3f}".format(target, twice))
+
+    if steady_sent * 10 > steady_events:
+        failures.append("only {:.1f}x fewer frames while steady".format(steady_events / max(steady_sent, 1)))
+    else:
+        print("steady frame reduction = {:.0f}x".format(steady_events / max(steady_sent, 1)))
+
+    if failures:
+        sys.exit("FAILED: " + "; ".join(failures))
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+
+# Compare the number of axis events per second that ThrusterController can
+# process using its mixing tables against the original path, which converts the
+# joystick position to an angle and interpolates every thruster for every
+# event. The original path is a separate controller that only differs in how
+# it mixes, so the speedup is that of the mixing alone. Expect a modest gain,
+# about 1.1x to 1.3x. Both paths must produce the same thruster values. The tables
+# interpolate between samples of the thruster curves, so the values may differ
+# in the last few bits, but never by enough to change a PWM tick. Before
+# timing anything, every joystick position at PRECISION resolution is checked.
+#
+# Run this from the services/controllers directory so the thruster settings
+# file is picked up.
+
+import random
+import time
+from thruster_controller import ThrusterController, PRECISION, FULL_REVERSE, FULL_FORWARD
+from thruster_controller import HL, VL, VC, VR, HR, JL_H, JL_V, JR_H, JR_V, AL, AR
+from utils import map_range
+from vector2d import Vector2D
+
+
+EVENT_COUNT = 200000
+SEED = 1234
+
+# the largest difference we accept between a table value and the value
+# calculated by interpolating
+TOLERANCE = 1e-9
+
+
+class RecordingController(ThrusterController):
+    '''
+    A simulated thruster controller that remembers the last value sent to each
+    motor instead of sending it to the PWM controller
+    '''
+
+    def __init__(self):
+        self.motors = {}
+        ThrusterController.__init__(self, True)
+
+    def set_motor(self, motor_number, value, settings=None):
+        self.motors[motor_number] = value
+
+
+class InterpolatingController(RecordingController):
+    '''
+    A controller that calculates thruster values the way update_axis did
+    before the mixing tables were introduced: convert the joystick position
+    to an angle and a length, then interpolate every thruster curve. Only the
+    mixing differs from ThrusterController.update_axis, so the benchmark
+    measures just that.
+    '''
+
+    def update_axis(self, axis, value):
+        value = round(value, PRECISION)
+        update_horizontal_thrusters = False
+        update_vertical_thrusters = False
+
+        if axis == JL_H:
+            if self.j1.x != value:
+                self.j1.x = value
+                update_horizontal_thrusters = True
+        elif axis == JL_V:
+            if self.j1.y != value:
+                self.j1.y = value
+                update_horizontal_thrusters = True
+        elif axis == JR_H:
+            if self.j2.x != value:
+                self.j2.x = value
+                update_vertical_thrusters = True
+        elif axis == JR_V:
+            if self.j2.y != value:
+                self.j2.y = value
+                update_vertical_thrusters = True
+        elif axis == AL:
+            if self.descent != value:
+                self.descent = value
+                update_vertical_thrusters = True
+        elif axis == AR:
+            if self.ascent != value:
+                self.ascent = value
+                update_vertical_thrusters = True
+
+        settings = self.settings
+
+        if update_horizontal_thrusters:
+            angle = self.j1.angle
+            power = min(1.0, self.j1.length)
+            left_value = settings.horizontal_left.valueAtIndex(angle) * power
+            right_value = settings.horizontal_right.valueAtIndex(angle) * power
+            with self.batch():
+                self.set_motor(HL, left_value, settings)
+                self.set_motor(HR, right_value, settings)
+
+        if update_vertical_thrusters:
+            angle = self.j2.angle
+            power = min(1.0, self.j2.length)
+            back_value = settings.vertical_center.valueAtIndex(angle) * power
+            front_left_value = settings.vertical_left.valueAtIndex(angle) * power
+            front_right_value = settings.vertical_right.valueAtIndex(angle) * power
+            if self.ascent != -1.0:
+                percent = (1.0 + self.ascent) / 2.0
+                max_adjust = (1.0 - max(back_value, front_left_value, front_right_value)) * percent
+                front_left_value += max_adjust
+                front_right_value += max_adjust
+            elif self.descent != -1.0:
+                percent = (1.0 + self.descent) / 2.0
+                max_adjust = (min(back_value, front_left_value, front_right_value) - -1.0) * percent
+                front_left_value -= max_adjust
+                front_right_value -= max_adjust
+            with self.batch():
+                self.set_motor(VC, back_value, settings)
+                self.set_motor(VL, front_left_value, settings)
+                self.set_motor(VR, front_right_value, settings)
+
+
+def make_events(count):
+    '''
+    Simulate a pilot moving the sticks: each event nudges one axis a small
+    random amount so positions are revisited the way they are in a real dive
+    '''
+    random.seed(SEED)
+    axes = (JL_H, JL_V, JR_H, JR_V, AL, AR)
+    values = {axis: 0.0 for axis in axes}
+    values[AL] = -1.0
+    values[AR] = -1.0
+    events = []
+
+    for i in range(count):
+        axis = random.choice(axes)
+        value = values[axis] + random.uniform(-0.05, 0.05)
+        value = max(-1.0, min(value, 1.0))
+        values[axis] = value
+        events.append((axis, value))
+
+    return events
+
+
+def run(controller, events):
+    motors = []
+    start = time.perf_counter()
+
+    for (axis, value) in events:
+        controller.update_axis(axis, value)
+
+    elapsed = time.perf_counter() - start
+
+    for motor in (HL, VL, VC, VR, HR):
+        motors.append(controller.motors.get(motor))
+
+    return elapsed, motors
+
+
+def matches(reference, table):
+    return all(abs(reference[motor] - table[motor]) <= TOLERANCE for motor in reference)
+
+
+def check(events):
+    '''
+    Make sure both paths agree on every single event, not just the last one
+    '''
+    reference = InterpolatingController()
+    table = RecordingController()
+
+    for (axis, value) in events:
+        reference.update_axis(axis, value)
+        table.update_axis(axis, value)
+
+        if reference.motors.keys() != table.motors.keys() or not matches(reference.motors, table.motors):
+            raise AssertionError("thruster values differ after axis {} = {}".format(axis, value))
+
+
+def tick(settings, value):
+    return int(map_range(settings.apply_sensitivity(value), -1.0, 1.0, FULL_REVERSE, FULL_FORWARD))
+
+
+def check_grid(settings):
+    '''
+    Compare both mixing tables against the interpolators at every joystick
+    position at PRECISION resolution. Returns the number of positions, the
+    largest difference in any thruster value and the number of thruster
+    values that would be sent to the PWM controller as a different tick.
+    '''
+    steps = 10 ** PRECISION
+    positions = 0
+    largest = 0.0
+    different_ticks = 0
+
+    for i in range(-steps, steps + 1):
+        x = i / float(steps)
+
+        for j in range(-steps, steps + 1):
+            y = j / float(steps)
+            vector = Vector2D(x, y)
+            angle = vector.angle
+            power = min(1.0, vector.length)
+
+            for mix in (settings.horizontal_mix, settings.vertical_mix):
+                values = mix.values(x, y)
+
+                for (interpolator, value) in zip(mix.interpolators, values):
+                    reference = interpolator.valueAtIndex(angle) * power
+                    largest = max(largest, abs(reference - value))
+
+                    if tick(settings, reference) != tick(settings, value):
+                        different_ticks += 1
+
+            positions += 1
+
+    return positions, largest, different_ticks
+
+
+if __name__ == "__main__":
+    events = make_events(EVENT_COUNT)
+
+    positions, largest, different_ticks = check_grid(RecordingController().settings)
+
+    print("grid positions       =", positions)
+    print("largest difference   = {:.3g}".format(largest))
+    print("different PWM ticks  =", different_ticks)
+
+    assert largest <= TOLERANCE
+    assert different_ticks == 0
+
+    check(events[:20000])
+
+    reference_time, reference_motors = run(InterpolatingController(), events)
+    table_time, table_motors = run(RecordingController(), events)
+
+    assert all(abs(a - b) <= TOLERANCE for (a, b) in zip(reference_motors, table_motors))
+
+    print("events               =", len(events))
+    print("precision            =", PRECISION)
+    print("interpolate events/s = {:.0f}".format(len(events) / reference_time))
+    print("table events/s       = {:.0f}".format(len(events) / table_time))
+    print("speedup              = {:.2f}x".format(reference_time / table_time))
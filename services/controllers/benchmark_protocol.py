@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+# Measure message throughput and latency between a client and the thruster
+# server, first waiting for an "OK" after every message and then pipelining
+# messages with cumulative acks. A local thruster server is started in
+# simulation mode for the duration of the benchmark, so no hardware is
+# needed. Make sure nothing else is listening on the controller port.
+
+import os
+import socket
+import subprocess
+import sys
+import time
+from input_types import AXIS
+from thruster_connection import ThrusterConnection, DEFAULT_WINDOW
+
+
+HOST = "127.0.0.1"
+PORT = 9999
+MESSAGE_COUNT = 20000
+
+JL_H = 0  # left joystick horizontal axis
+
+
+def start_server():
+    script_dir = os.path.dirname(os.path.realpath(__file__))
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(script_dir, "thruster_server.py"), "--simulate"],
+        cwd=script_dir,
+        stdout=subprocess.DEVNULL
+    )
+
+    # wait for the server to start listening
+    for i in range(100):
+        try:
+            socket.create_connection((HOST, PORT)).close()
+            return server
+        except ConnectionRefusedError:
+            time.sleep(0.1)
+
+    server.kill()
+    raise RuntimeError("thruster server did not start")
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    index = min(len(values) - 1, int(len(values) * percent / 100.0))
+
+    return values[index]
+
+
+def run(pipeline, window=DEFAULT_WINDOW):
+    connection = ThrusterConnection(HOST, PORT, pipeline, window)
+    connection.latencies = []
+
+    start = time.perf_counter()
+
+    for i in range(MESSAGE_COUNT):
+        # sweep the stick back and forth so every message changes the thrusters
+        value = ((i % 2001) - 1000) / 1000.0
+        connection.send(0, AXIS, JL_H, value)
+
+    connection.flush(10.0)
+    elapsed = time.perf_counter() - start
+    connection.close()
+
+    latencies = connection.latencies
+
+    print("pipelined          =", connection.pipelined)
+    if connection.pipelined:
+        print("window             =", window)
+    print("messages/s         = {:.0f}".format(MESSAGE_COUNT / elapsed))
+    print("median latency ms  = {:.3f}".format(1000.0 * percentile(latencies, 50)))
+    print("99th latency ms    = {:.3f}".format(1000.0 * percentile(latencies, 99)))
+    print()
+
+
+if __name__ == "__main__":
+    server = start_server()
+
+    try:
+        run(False)
+        run(True)
+    finally:
+        server.terminate()
+        server.wait()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+# Time how long it takes to calculate the full thruster response surface for
+# both joysticks, then check a random sample of points against the values that
+# update_axis sends to the motors. Exits with an error when the surface takes
+# longer than TARGET_SECONDS or any tick differs.
+#
+# Run this from the services/controllers directory so the thruster settings
+# file is picked up.
+
+import random
+import sys
+import time
+import numpy
+from thruster_controller import ThrusterController, FULL_REVERSE, FULL_FORWARD
+from thruster_controller import HL, VL, VC, VR, HR, JL_H, JL_V, JR_H, JR_V, AL, AR
+from utils import map_range
+
+
+GRID_SIZE = 1001
+
+# the calibration page recalculates the surface while a curve is being
+# edited, so it has to be well under a second
+TARGET_SECONDS = 0.5
+
+# the best of this many runs is reported, so a busy machine doesn't fail us
+RUNS = 3
+SAMPLE_COUNT = 5000
+SEED = 1234
+
+
+class RecordingController(ThrusterController):
+    '''
+    A simulated thruster controller that remembers the PWM ticks it would send
+    to each motor
+    '''
+
+    def __init__(self):
+        self.ticks = {}
+        ThrusterController.__init__(self, True)
+
+    def set_motor(self, motor_number, value, settings=None):
+        value = (settings or self.settings).apply_sensitivity(value)
+        self.ticks[motor_number] = int(map_range(value, -1.0, 1.0, FULL_REVERSE, FULL_FORWARD))
+
+
+if __name__ == "__main__":
+    controller = RecordingController()
+
+    axis = numpy.linspace(-1.0, 1.0, GRID_SIZE)
+    (x, y) = numpy.meshgrid(axis, axis)
+
+    elapsed = None
+
+    for run in range(RUNS):
+        start = time.perf_counter()
+        (values, ticks) = controller.evaluate(x, y, x, y)
+        seconds = time.perf_counter() - start
+
+        if elapsed is None or seconds < elapsed:
+            elapsed = seconds
+
+    print("grid               = {0}x{0}".format(GRID_SIZE))
+    print("seconds            = {:.3f}".format(elapsed))
+    print("target seconds     = {:.3f}".format(TARGET_SECONDS))
+
+    random.seed(SEED)
+    mismatches = 0
+
+    for i in range(SAMPLE_COUNT):
+        state = [round(random.uniform(-1.0, 1.0), 3) for j in range(4)]
+        triggers = [-1.0, -1.0]
+        triggers[random.randrange(2)] = round(random.uniform(-1.0, 1.0), 3)
+
+        for (axis_number, value) in zip((JL_H, JL_V, JR_H, JR_V, AL, AR), state + triggers):
+            controller.update_axis(axis_number, value)
+
+        # the right trigger (ascent) wins when both are pressed, matching
+        # update_axis
+        (_, expected) = controller.evaluate(state[0], state[1], state[2], state[3], triggers[1], triggers[0])
+
+        for motor in (HL, VL, VC, VR, HR):
+            if controller.ticks[motor] != expected[motor]:
+                mismatches += 1
+
+    print("sampled points     =", SAMPLE_COUNT)
+    print("mismatched ticks   =", mismatches)
+
+    if elapsed > TARGET_SECONDS:
+        sys.exit("FAILED: the response surface took longer than {} seconds".format(TARGET_SECONDS))
+
+    if mismatches > 0:
+        sys.exit("FAILED: {} ticks differ from update_axis".format(mismatches))
@@ -85,7 +85,8 @@ function saveSettings() {
             data.thrusters[2].to_array(),
             data.thrusters[3].to_array(),
             data.thrusters[4].to_array()
-        ]
+        ],
+        slew: data.slew
     }, function(error) {
         if (error) {
             console.error(error);
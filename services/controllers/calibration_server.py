@@ -0,0 +1,182 @@
+import asyncio
+import json
+import mimetypes
+import os
+import traceback
+from urllib.parse import urlsplit, unquote, parse_qs
+
+
+SCRIPT_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), "calibration")
+CSS_DIR = os.path.join(SCRIPT_DIR, "css")
+JS_DIR = os.path.join(SCRIPT_DIR, "js")
+
+REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    500: "Internal Server Error"
+}
+
+
+def json_response(data, status=200):
+    return status, "application/json", json.dumps(data).encode("utf-8")
+
+
+def file_response(filename, root):
+    # never let a request escape the directory it is being served from
+    path = os.path.join(root, os.path.basename(filename))
+
+    if not os.path.isfile(path):
+        return json_response({'status': 'Not Found'}, 404)
+
+    content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+    with open(path, 'rb') as f:
+        return 200, content_type, f.read()
+
+
+async def route(controller, method, path, body):
+    '''
+    Return the status, content type and content for a request. These are the
+    same routes the calibration page used when it was served by bottle.
+
+    PUT /api/settings?save=0 applies settings without saving them, which is
+    handy for trying out a change before keeping it.
+
+    This runs on the same event loop as thruster control, so files and
+    profiles are read on a worker thread rather than holding up the loop.
+    '''
+    loop = asyncio.get_event_loop()
+    url = urlsplit(path)
+    query = parse_qs(url.query)
+
+    # split before decoding so an escaped slash stays part of a name
+    parts = [unquote(part) for part in url.path.split("/") if part != ""]
+
+    if method == "PUT":
+        if parts == ["api", "settings"]:
+            try:
+                data = json.loads(body.decode("utf-8"))
+            except ValueError:
+                return json_response({'status': 'Invalid JSON'}, 400)
+
+            if not isinstance(data, dict):
+                return json_response({'status': 'Invalid Settings'}, 400)
+
+            save = query.get('save', ['1'])[-1] not in ('0', 'false')
+
+            if controller.set_settings(data, save):
+                return json_response({'status': 'OK'})
+            else:
+                return json_response({'status': 'Invalid Settings'}, 400)
+        elif len(parts) == 3 and parts[0:2] == ["api", "settings"]:
+            # switch to a named profile without sending it back and forth.
+            # Loading it puts it in the profile cache, so switching to it
+            # only checks that the file did not change in the meantime
+            try:
+                profile = await loop.run_in_executor(None, controller.profiles.get, parts[2])
+
+                if profile is not None and controller.use_profile(parts[2]):
+                    return json_response({'status': 'OK'})
+                else:
+                    return json_response({'status': 'Not Found'}, 404)
+            except ValueError:
+                return json_response({'status': 'Invalid Settings'}, 400)
+        else:
+            return json_response({'status': 'Not Found'}, 404)
+    elif method != "GET":
+        return json_response({'status': 'Method Not Allowed'}, 405)
+
+    if len(parts) == 0:
+        return await loop.run_in_executor(None, file_response, 'index.html', SCRIPT_DIR)
+    elif len(parts) == 2 and parts[0] == "css":
+        return await loop.run_in_executor(None, file_response, parts[1], CSS_DIR)
+    elif len(parts) == 2 and parts[0] == "js":
+        return await loop.run_in_executor(None, file_response, parts[1], JS_DIR)
+    elif parts == ["api", "settings"]:
+        return json_response(controller.get_settings())
+    elif len(parts) == 3 and parts[0:2] == ["api", "settings"]:
+        # named profiles come from the controller's cache when they haven't
+        # changed on disk
+        try:
+            profile = await loop.run_in_executor(None, controller.profiles.get, parts[2])
+        except ValueError:
+            return json_response({'status': 'Invalid Settings'}, 400)
+
+        if profile is None:
+            return json_response({'status': 'Not Found'}, 404)
+        else:
+            return json_response(profile.to_data())
+    else:
+        return json_response({'status': 'Not Found'}, 404)
+
+
+def write_response(writer, status, content_type, content):
+    header = "HTTP/1.1 {} {}\r\nContent-Type: {}\r\nContent-Length: {}\r\nConnection: close\r\n\r\n".format(
+        status,
+        REASONS[status],
+        content_type,
+        len(content)
+    )
+
+    writer.write(header.encode("latin-1") + content)
+
+
+async def handle_request(controller, reader, writer):
+    '''
+    A deliberately small HTTP/1.1 handler. It serves one request per
+    connection, which is all the calibration page needs.
+    '''
+    try:
+        request_line = await reader.readline()
+
+        if not request_line:
+            return
+
+        try:
+            (method, path, version) = request_line.decode("latin-1").split()
+            headers = {}
+
+            while True:
+                line = await reader.readline()
+
+                if line in (b"\r\n", b"\n", b""):
+                    break
+
+                (name, _, value) = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+
+            length = int(headers.get("content-length", 0))
+        except ValueError:
+            write_response(writer, *json_response({'status': 'Bad Request'}, 400))
+            await writer.drain()
+            return
+
+        body = await reader.readexactly(length) if length > 0 else b""
+
+        try:
+            response = await route(controller, method, path, body)
+        except Exception:
+            # a bug in a route must not leave the browser waiting forever
+            traceback.print_exc()
+            response = json_response({'status': 'Internal Server Error'}, 500)
+
+        write_response(writer, *response)
+        await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+def start_calibration_server(controller, host, port):
+    return asyncio.start_server(
+        lambda reader, writer: handle_request(controller, reader, writer),
+        host,
+        port
+    )
+
+
+if __name__ == "__main__":
+    pass
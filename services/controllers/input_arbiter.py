@@ -0,0 +1,145 @@
+from input_types import MOTOR, BUTTON
+from message_3 import Message
+from thruster_controller import AL, AR
+
+
+# Every message carries a controller index from 0 to 3. The pilot's game
+# controller uses PILOT and scripts like thruster_automation use AUTOMATION.
+# Higher priorities win. By default a lower controller index has priority, so
+# the pilot always overrides automation.
+DEFAULT_PRIORITIES = {0: 3, 1: 2, 2: 1, 3: 0}
+
+# A controller keeps its claim on the thrusters for this many seconds after
+# its last message, even when all of its axes are at rest. This keeps a pilot
+# who lets go of the sticks for a moment from handing the vehicle straight
+# back to automation.
+OWNERSHIP_TIMEOUT = 2.0
+
+# The analog triggers rest at -1.0. Every other axis rests at 0.0.
+REST_VALUES = {AL: -1.0, AR: -1.0}
+
+
+def rest_value(type, index):
+    if type == MOTOR:
+        return 0.0
+    else:
+        return REST_VALUES.get(index, 0.0)
+
+
+class InputArbiter:
+    '''
+    Decides which controller drives the thrusters when several clients are
+    connected at once.
+
+    We remember the latest axis and motor values of every controller. A
+    controller is engaged while any of its axes is away from rest, or for
+    OWNERSHIP_TIMEOUT seconds after its last message. The engaged controller
+    with the highest priority owns the thrusters, and only its values are
+    applied. When ownership changes, the new owner's complete state is
+    applied, with any axis it has not set returned to rest, so nothing is
+    left over from the previous owner. Button presses from every controller
+    are applied.
+
+    arbitrate is called once per control tick with the messages that arrived
+    since the last tick, so however many clients are connected, the
+    thrusters are updated at most once per tick.
+    '''
+
+    def __init__(self, priorities=DEFAULT_PRIORITIES, timeout=OWNERSHIP_TIMEOUT):
+        self.priorities = priorities
+        self.timeout = timeout
+        self.states = {}
+        self.last_active = {}
+        self.owner = None
+        self.reset_requested = False
+
+        # counts of messages applied and messages overridden by another
+        # controller
+        self.applied = 0
+        self.overridden = 0
+
+    def release(self, controller):
+        '''
+        Forget a controller, usually because its client disconnected. If it
+        owned the thrusters, they are turned off on the next arbitrate.
+        '''
+        self.states.pop(controller, None)
+        self.last_active.pop(controller, None)
+
+        if self.owner == controller:
+            self.owner = None
+            self.reset_requested = True
+
+    def engaged(self, controller, now):
+        if now - self.last_active.get(controller, now - self.timeout - 1.0) <= self.timeout:
+            return True
+
+        for ((type, index), m) in self.states[controller].items():
+            if m.input_value != rest_value(type, index):
+                return True
+
+        return False
+
+    def arbitrate(self, messages, now):
+        '''
+        Return a flag indicating whether the motors should be turned off,
+        followed by the list of messages to apply in this tick
+        '''
+        buttons = []
+        updates = {}
+
+        for m in messages:
+            self.last_active[m.controller_index] = now
+
+            if m.input_type == BUTTON:
+                buttons.append(m)
+            else:
+                key = (m.input_type, m.input_index)
+                self.states.setdefault(m.controller_index, {})[key] = m
+                updates.setdefault(m.controller_index, []).append(m)
+
+        # pick the owner for this tick
+        engaged = [controller for controller in self.states if self.engaged(controller, now)]
+
+        if engaged:
+            owner = max(engaged, key=lambda controller: self.priorities.get(controller, 0))
+        else:
+            owner = self.owner
+
+        reset_requested = self.reset_requested
+        self.reset_requested = False
+
+        if owner != self.owner and owner is not None:
+            self.owner = owner
+            apply = self.takeover(owner)
+        else:
+            apply = updates.get(owner, [])
+
+        for (controller, controller_updates) in updates.items():
+            if controller != owner:
+                self.overridden += len(controller_updates)
+
+        self.applied += len(apply) + len(buttons)
+
+        return reset_requested, apply + buttons
+
+    def takeover(self, owner):
+        '''
+        Return the messages that put the thrusters into the new owner's state
+        '''
+        state = self.states.get(owner, {})
+        apply = list(state.values())
+        known = set()
+
+        for controller_state in self.states.values():
+            known.update(controller_state.keys())
+
+        for (type, index) in known:
+            if (type, index) not in state:
+                apply.append(Message.create(owner, type, index, rest_value(type, index)))
+
+        return apply
+
+
+if __name__ == "__main__":
+    pass
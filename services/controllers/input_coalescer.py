@@ -0,0 +1,63 @@
+import threading
+from input_types import BUTTON
+
+
+class InputCoalescer:
+    '''
+    Collects incoming messages between control ticks.
+
+    A controller can send axis values much faster than we need to update the
+    thrusters, and only the most recent value of each axis matters. So, for
+    axes and motors we keep only the latest message for each (controller, type,
+    index) slot. Buttons are different: every press and release is an edge we
+    must not lose, so button messages are queued in the order they arrived.
+
+    Messages may be added from any thread. The control loop calls take once per
+    tick to get everything that should be applied during that tick.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latest = {}
+        self.buttons = []
+
+        # these counters let us see how much work coalescing saves
+        self.received = 0
+        self.applied = 0
+
+    def put(self, m):
+        with self.lock:
+            if m.input_type == BUTTON:
+                self.buttons.append(m)
+            else:
+                self.latest[(m.controller_index, m.input_type, m.input_index)] = m
+
+            self.received += 1
+
+    def discard(self, controller_index):
+        '''
+        Drop any pending messages from one controller
+        '''
+        with self.lock:
+            self.latest = {
+                key: m for (key, m) in self.latest.items()
+                if m.controller_index != controller_index
+            }
+            self.buttons = [m for m in self.buttons if m.controller_index != controller_index]
+
+    def take(self):
+        '''
+        Return the list of messages to apply in this tick
+        '''
+        with self.lock:
+            messages = list(self.latest.values()) + self.buttons
+
+            self.latest = {}
+            self.buttons = []
+            self.applied += len(messages)
+
+        return messages
+
+
+if __name__ == "__main__":
+    pass
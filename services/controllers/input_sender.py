@@ -0,0 +1,132 @@
+import time
+import threading
+from collections import OrderedDict
+from input_types import BUTTON
+from input_coalescer import InputCoalescer
+from message_3 import Message
+
+
+# The most times per second we send controller changes to the server. This is
+# above the rate the thruster server applies them, so sending at this rate
+# never adds a noticeable delay.
+SEND_RATE = 120
+
+
+class InputSender:
+    '''
+    Sends controller input to the thruster server from a background thread.
+
+    The input loop puts values here as fast as events arrive and never waits
+    on the network. Values are collected with an InputCoalescer, so only the
+    latest value of each axis is kept, and at most SEND_RATE times per second
+    the sender thread sends the axes that changed since they were last sent.
+    If the network falls behind, values that could not be sent are replaced
+    by newer ones instead of queueing up behind them. Button presses and
+    releases are always sent in order.
+
+    When nothing changes, the sender thread sleeps until the next put, so an
+    idle controller costs no CPU.
+    '''
+
+    def __init__(self, connection, rate=SEND_RATE):
+        self.connection = connection
+        self.period = 1.0 / rate
+        self.inputs = InputCoalescer()
+        self.wakeup = threading.Event()
+        self.running = True
+
+        # values waiting to be sent. Axes are keyed by (controller, type,
+        # index) so a newer value replaces an older one
+        self.unsent_axes = OrderedDict()
+        self.unsent_buttons = []
+
+        # the last value sent for each axis
+        self.sent = {}
+        self.messages_sent = 0
+
+        self.thread = threading.Thread(target=self.run, name="input-sender")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def put(self, controller, type, index, value):
+        self.inputs.put(Message.create(controller, type, index, value))
+        self.wakeup.set()
+
+    def close(self):
+        '''
+        Send anything still waiting, then stop the sender thread
+        '''
+        self.running = False
+        self.wakeup.set()
+        self.thread.join()
+
+    def run(self):
+        next_send = time.perf_counter()
+
+        while self.running:
+            self.wakeup.wait()
+            self.wakeup.clear()
+
+            # never send more often than our rate
+            delay = next_send - time.perf_counter()
+
+            if delay > 0:
+                time.sleep(delay)
+
+            next_send = max(next_send, time.perf_counter() - self.period) + self.period
+
+            self.send_changes()
+
+            # if the network could not take everything, try again on the next
+            # send without waiting for new input
+            if self.pending():
+                self.wakeup.set()
+
+        self.send_changes()
+
+    def pending(self):
+        return len(self.unsent_axes) > 0 or len(self.unsent_buttons) > 0 or len(self.connection.outgoing) > 0
+
+    def send_changes(self):
+        messages = self.inputs.take()
+
+        for m in messages:
+            if m.input_type == BUTTON:
+                self.unsent_buttons.append(m)
+            else:
+                key = (m.controller_index, m.input_type, m.input_index)
+
+                # an axis that moved away and back again does not need sending
+                if self.sent.get(key) == m.input_value:
+                    self.unsent_axes.pop(key, None)
+                else:
+                    self.unsent_axes[key] = m
+
+        batch = self.unsent_buttons + list(self.unsent_axes.values())
+
+        if len(batch) == 0:
+            self.connection.write_outgoing()
+            return
+
+        if self.connection.pipelined:
+            count = self.connection.send_nowait(batch)
+        else:
+            # the server answers every message, so we have to wait for each
+            # one. Only this thread waits; input keeps being collected
+            for m in batch:
+                self.connection.send(m.controller_index, m.input_type, m.input_index, m.input_value)
+            count = len(batch)
+
+        for m in batch[:count]:
+            if m.input_type == BUTTON:
+                self.unsent_buttons.pop(0)
+            else:
+                key = (m.controller_index, m.input_type, m.input_index)
+                self.sent[key] = m.input_value
+                del self.unsent_axes[key]
+
+        self.messages_sent += count
+
+
+if __name__ == "__main__":
+    pass
@@ -1,3 +1,9 @@
 MOTOR = 0
 AXIS = 1
 BUTTON = 2
+CONTROL = 3
+
+# Controller indices. The thruster server gives the pilot priority over
+# automation when both are connected
+PILOT = 0
+AUTOMATION = 3
@@ -1,35 +1,154 @@
+from bisect import bisect_right
+
+# NumPy is optional. When it is available, valuesAtIndices evaluates all of the
+# indices in one vectorized call. Otherwise we fall back to a pure Python loop.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+NAN = float("nan")
+
+
 class Interpolator:
+    '''
+    A piecewise-linear interpolator. Index/value pairs may be added in any
+    order. They are kept sorted by index, and the index and value deltas of
+    each segment are precomputed, so a lookup is a binary search followed by
+    a little arithmetic no matter how many points the curve has. The
+    arithmetic is the same as it always was, so the results are bit for bit
+    the same as walking the points in order.
+    '''
 
     def __init__(self):
         self.data = []
+        self.indices = []
+        self.values = []
+        self.index_deltas = []
+        self.value_deltas = []
+        self.compiled = True
 
     def addIndexValue(self, index, value):
-        self.data.append((index, value))
+        # keep points with equal indices in the order they were added so the
+        # first one wins on an exact match
+        position = bisect_right(self.indices, index)
+
+        self.data.insert(position, (index, value))
+        self.indices.insert(position, index)
+        self.compiled = False
+
+    def compile(self):
+        '''
+        Rebuild the value and delta arrays from the sorted points. Each delta
+        belongs to the segment that starts at the point with the same position.
+        The last point has no segment, so it gets an index delta of one and a
+        value delta of zero. Neither is used for interpolation.
+        '''
+        self.values = [value for (index, value) in self.data]
+        self.index_deltas = []
+        self.value_deltas = []
+
+        for i in range(len(self.data) - 1):
+            (start_index, start_value) = self.data[i]
+            (end_index, end_value) = self.data[i + 1]
+
+            self.index_deltas.append(end_index - start_index)
+            self.value_deltas.append(end_value - start_value)
+
+        if self.data:
+            self.index_deltas.append(1)
+            self.value_deltas.append(0)
+
+        self.compiled = True
+
+    def segmentAtIndex(self, target_index):
+        '''
+        Return the position of the point that starts the segment containing
+        target_index, or -1 if target_index is outside of the curve. An exact
+        match on a point returns that point's position.
+        '''
+        indices = self.indices
+
+        if not indices or target_index < indices[0] or indices[-1] < target_index:
+            return -1
+
+        position = bisect_right(indices, target_index) - 1
+
+        # step back over duplicate indices so the first point added wins
+        while position > 0 and indices[position - 1] == target_index:
+            position -= 1
+
+        return position
 
     def valueAtIndex(self, target_index):
-        if target_index < self.data[0][0]:
-            return None
-        elif self.data[-1][0] < target_index:
+        if not self.compiled:
+            self.compile()
+
+        position = self.segmentAtIndex(target_index)
+
+        if position == -1:
             return None
+
+        start_index = self.indices[position]
+
+        if start_index == target_index:
+            return self.values[position]
         else:
-            start = None
-            end = None
+            percent = (target_index - start_index) / self.index_deltas[position]
+
+            return self.values[position] + self.value_deltas[position] * percent
+
+    def valuesAtIndices(self, target_indices):
+        '''
+        Evaluate the curve at many indices in one call. With NumPy available,
+        this returns a float array, otherwise a list of floats. Either way,
+        indices outside of the curve are NaN, so the result is always numeric.
+        '''
+        if not self.compiled:
+            self.compile()
+
+        if numpy is None:
+            result = []
+
+            for target_index in target_indices:
+                value = self.valueAtIndex(target_index)
+                result.append(NAN if value is None else value)
 
-            for (index, value) in self.data:
-                if index == target_index:
-                    return value
-                else:
-                    if index <= target_index:
-                        start = (index, value)
-                    elif target_index < index:
-                        end = (index, value)
-                        break
+            return result
 
-            index_delta = end[0] - start[0]
-            percent = (target_index - start[0]) / index_delta
-            value_delta = end[1] - start[1]
+        targets = numpy.asarray(target_indices, dtype=float)
+        result = numpy.full(targets.shape, numpy.nan)
 
-            return start[1] + value_delta * percent
+        if not self.indices:
+            return result
+
+        indices = numpy.asarray(self.indices, dtype=float)
+        values = numpy.asarray(self.values, dtype=float)
+        index_deltas = numpy.asarray(self.index_deltas, dtype=float)
+        value_deltas = numpy.asarray(self.value_deltas, dtype=float)
+
+        inside = (indices[0] <= targets) & (targets <= indices[-1])
+        inside_targets = targets[inside]
+
+        # searchsorted on the left side lands exactly on the first of any
+        # duplicate points, otherwise we step back to the start of the segment
+        positions = numpy.searchsorted(indices, inside_targets, side='left')
+        positions = numpy.minimum(positions, len(indices) - 1)
+        exact = indices[positions] == inside_targets
+        positions = numpy.where(exact, positions, positions - 1)
+
+        inside_values = values[positions]
+
+        # only interpolate between points, so the zero index delta between
+        # duplicate points is never divided by
+        between = ~exact
+        starts = positions[between]
+        percent = (inside_targets[between] - indices[starts]) / index_deltas[starts]
+        inside_values[between] += value_deltas[starts] * percent
+
+        result[inside] = inside_values
+
+        return result
 
     def to_array(self):
         result = []
@@ -42,8 +161,10 @@ class Interpolator:
 
     def from_array(self, array):
         self.data = []
+        self.indices = []
         for i in range(0, len(array), 2):
             self.addIndexValue(array[i], array[i + 1])
+        self.compile()
 
 
 if __name__ == "__main__":
@@ -1,5 +1,21 @@
 import struct
 
+# Every message is exactly this many bytes on the wire: one byte for the
+# controller, type and index, followed by a 32-bit float value
+MESSAGE_SIZE = 5
+
+# Messages with the CONTROL input type manage the connection itself rather
+# than the thrusters. A client sends PIPELINE to ask the server to stop
+# answering every message with "OK". A server that supports pipelining
+# responds with an ACK instead. From then on, the server periodically sends an
+# ACK whose value is the number of messages it has processed so far, modulo
+# SEQUENCE_MODULUS. The modulus keeps the count exactly representable as a
+# 32-bit float.
+PIPELINE = 0
+ACK = 1
+SEQUENCE_MODULUS = 2 ** 24
+
+
 # Python3 Version of message class
 class Message:
 
@@ -12,10 +28,27 @@ class Message:
         self.input_index = b1 & 0x0F                    # 4 bits
         self.input_value = struct.unpack("f", b2)[0]    # 4 bytes (32 bits)
 
-        pass
+        # when the server filters a value before applying it, this holds the
+        # value as it arrived. Otherwise it is None
+        self.raw_value = None
+
+    @classmethod
+    def create(cls, controller, type, index, value):
+        m = cls()
+
+        m.controller_index = controller
+        m.input_type = type
+        m.input_index = index
+        m.input_value = value
+
+        return m
+
+    @property
+    def header(self):
+        return (self.controller_index & 0x03) << 6 | (self.input_type & 0x03) << 4 | (self.input_index & 0x0F)
 
     def __bytes__(self):
-        b1 = (self.controller_index & 0x03) << 6 | (self.input_type & 0x03) << 4 | (self.input_index & 0x0F)
+        b1 = self.header
         b2 = struct.pack("f", self.input_value)
 
         return bytes([b1]) + b2
@@ -28,6 +61,42 @@ class Message:
             self.input_value
         )
 
+
+class MessageDecoder:
+    '''
+    TCP is a stream protocol, so a single recv can return several messages at
+    once, or only part of one. This class reassembles whole messages from
+    whatever chunks of bytes we receive. Any trailing partial message is kept
+    until the rest of its bytes arrive.
+    '''
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    @property
+    def pending(self):
+        return len(self.buffer)
+
+    def feed(self, data):
+        '''
+        Add newly received bytes and yield a Message for every complete frame
+        that is now available
+        '''
+        buffer = self.buffer
+        buffer.extend(data)
+
+        complete = len(buffer) - len(buffer) % MESSAGE_SIZE
+
+        if complete == 0:
+            return
+
+        frames = bytes(buffer[:complete])
+        del buffer[:complete]
+
+        for offset in range(0, complete, MESSAGE_SIZE):
+            yield Message(frames[offset:offset + MESSAGE_SIZE])
+
+
 if __name__ == "__main__":
     m = Message(bytes([0x63, 0x00, 0x00, 0x80, 0x40]))
     print(str(m))
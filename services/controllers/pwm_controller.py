@@ -1,7 +1,24 @@
-import Adafruit_PCA9685
+import time
+from contextlib import contextmanager
+
+
+# PCA9685 register addresses from the datasheet. Each channel has four
+# consecutive registers (ON_L, ON_H, OFF_L, OFF_H) starting at LED0_ON_L.
+MODE1 = 0x00
+LED0_ON_L = 0x06
+REGISTERS_PER_CHANNEL = 4
+
+# When this MODE1 bit is set, the register address automatically advances
+# after each byte, which lets us write several channels in one I2C transaction
+AUTO_INCREMENT = 0x20
 
 
 class Device:
+    '''
+    One channel of the PCA9685. Setting on or off always goes through the
+    controller's set_pwm, which skips, and counts, writes that would not
+    change the registers.
+    '''
 
     def __init__(self, parent, name, channel, on, off):
         self.parent = parent
@@ -18,11 +35,8 @@ class Device:
 
     @on.setter
     def on(self, value):
-        value = max(0, min(value, 4095))
-
-        if self._on != value:
-            self._on = value
-            self.parent.set_pwm(self.channel, self.on, self.off)
+        self._on = max(0, min(value, 4095))
+        self.parent.set_pwm(self.channel, self._on, self._off)
 
     @property
     def off(self):
@@ -30,11 +44,8 @@ class Device:
 
     @off.setter
     def off(self, value):
-        value = max(0, min(value, 4095))
-
-        if self._off != value:
-            self._off = value
-            self.parent.set_pwm(self.channel, self.on, self.off)
+        self._off = max(0, min(value, 4095))
+        self.parent.set_pwm(self.channel, self._on, self._off)
 
     @property
     def duty_cycle(self):
@@ -62,13 +73,47 @@ class Device:
 
 
 class PWMController:
-    def __init__(self):
-        self.pwm = Adafruit_PCA9685.PCA9685()
+    def __init__(self, simulate=False):
+        # when simulating, we talk to an in-process PCA9685 instead of the
+        # real one. Everything else works exactly the same way
+        if simulate:
+            from simulated_pca9685 import PCA9685
+        else:
+            from Adafruit_PCA9685 import PCA9685
+
+        self.pwm = PCA9685()
         self._frequency = 60
         self.pwm.set_pwm_freq(self._frequency)
         self.devices = []
         self.current_device_index = 0
 
+        # enable register auto-increment so batches can be written as blocks
+        mode1 = self.pwm._device.readU8(MODE1)
+        self.pwm._device.write8(MODE1, mode1 | AUTO_INCREMENT)
+
+        # the last on/off values written to each channel. This is our shadow
+        # copy of the PCA9685 registers. We use it to skip writes that would
+        # not change anything, and to fill small gaps between dirty channels
+        # so a batch can be written in a single block
+        self.registers = {}
+
+        # counters for measuring how much we use the I2C bus. writes counts
+        # bus transactions, channels_written counts channels in those
+        # transactions, suppressed counts channel writes we skipped because
+        # the registers already held the value, and bus_time is the number of
+        # seconds spent in bus transactions. set_pwm and flush are the only
+        # places that decide whether to write, so every skip is counted, be
+        # it a device set to the value it already has or a channel changed
+        # and changed back inside of a batch
+        self.writes = 0
+        self.channels_written = 0
+        self.suppressed = 0
+        self.bus_time = 0.0
+
+        # pending channel values collected while inside of a batch
+        self.batch_depth = 0
+        self.dirty = {}
+
     @property
     def frequency(self):
         return self._frequency
@@ -97,7 +142,7 @@ class PWMController:
 
         self.current_device_index = len(self.devices)
         self.devices.append(device)
-        self.pwm.set_pwm(device.channel, device.on, device.off)
+        self.set_pwm(device.channel, device.on, device.off)
 
         return device
 
@@ -122,4 +167,118 @@ class PWMController:
         on = max(0, min(on, 4095))
         off = max(0, min(off, 4095))
 
-        self.pwm.set_pwm(channel, on, off)
+        if self.batch_depth > 0:
+            self.dirty[channel] = (on, off)
+        elif self.registers.get(channel) == (on, off):
+            self.suppressed += 1
+        else:
+            start = time.perf_counter()
+            self.pwm.set_pwm(channel, on, off)
+            self.bus_time += time.perf_counter() - start
+            self.writes += 1
+            self.channels_written += 1
+            self.registers[channel] = (on, off)
+
+    def counters(self):
+        return {
+            'writes': self.writes,
+            'channels_written': self.channels_written,
+            'suppressed': self.suppressed,
+            'bus_time': self.bus_time
+        }
+
+    def reset_counters(self):
+        self.writes = 0
+        self.channels_written = 0
+        self.suppressed = 0
+        self.bus_time = 0.0
+
+    @contextmanager
+    def batch(self):
+        '''
+        Collect all channel changes made inside of a with block and write them
+        to the PCA9685 together when the block exits. Contiguous channels are
+        written in one auto-increment block write, so all thrusters affected
+        by a control update change at the same time. Batches may be nested;
+        only the outermost batch flushes.
+        '''
+        self.batch_depth += 1
+
+        try:
+            yield self
+        finally:
+            self.batch_depth -= 1
+
+            if self.batch_depth == 0:
+                self.flush()
+
+    def flush(self):
+        if len(self.dirty) == 0:
+            return
+
+        # a channel may have been changed and then changed back inside of the
+        # batch, so only keep the channels that really differ from the
+        # registers
+        dirty = {}
+
+        for (channel, value) in self.dirty.items():
+            if self.registers.get(channel) == value:
+                self.suppressed += 1
+            else:
+                dirty[channel] = value
+
+        self.dirty = {}
+
+        if len(dirty) == 0:
+            return
+
+        for (first_channel, values) in self.blocks(dirty):
+            self.write_block(first_channel, values)
+
+    def blocks(self, dirty):
+        '''
+        Group dirty channels into runs of consecutive channels. A gap between
+        two dirty channels is bridged when we know what the skipped channels
+        currently hold, since rewriting a value is cheaper than starting a
+        second transaction.
+        '''
+        blocks = []
+        first_channel = None
+        values = []
+
+        for channel in range(min(dirty), max(dirty) + 1):
+            if channel in dirty:
+                value = dirty[channel]
+            else:
+                value = self.registers.get(channel)
+
+            if value is None:
+                if first_channel is not None:
+                    blocks.append((first_channel, values))
+                first_channel = None
+                values = []
+            else:
+                if first_channel is None:
+                    first_channel = channel
+                values.append(value)
+
+        if first_channel is not None:
+            blocks.append((first_channel, values))
+
+        return blocks
+
+    def write_block(self, first_channel, values):
+        data = []
+
+        for (on, off) in values:
+            data.extend((on & 0xFF, on >> 8, off & 0xFF, off >> 8))
+
+        register = LED0_ON_L + REGISTERS_PER_CHANNEL * first_channel
+        start = time.perf_counter()
+        self.pwm._device.writeList(register, data)
+        self.bus_time += time.perf_counter() - start
+        self.writes += 1
+        self.channels_written += len(values)
+
+        for (i, value) in enumerate(values):
+            self.registers[first_channel + i] = value
@@ -0,0 +1,240 @@
+import json
+from input_types import MOTOR, AXIS, BUTTON
+from automation import Schedule, DEFAULT_RATE
+from thruster_controller import (
+    ThrusterController,
+    HL, VL, VC, VR, HR, LIGHT,
+    JL_H, JL_V, JR_H, JR_V, AL, AR,
+    UP, DOWN, RESET
+)
+
+# YAML is optional. Without it, only JSON sequence files can be loaded.
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+
+# Axes, motors and buttons can be given by name or by number in a sequence
+AXIS_NAMES = {'JL_H': JL_H, 'JL_V': JL_V, 'JR_H': JR_H, 'JR_V': JR_V, 'AL': AL, 'AR': AR}
+MOTOR_NAMES = {'HL': HL, 'VL': VL, 'VC': VC, 'VR': VR, 'HR': HR, 'LIGHT': LIGHT}
+BUTTON_NAMES = {'UP': UP, 'DOWN': DOWN, 'RESET': RESET}
+
+# The rate the thruster server applies messages at. The dry run uses this to
+# step the controller the same way the server does.
+SERVER_RATE = 100
+
+
+def load_sequence(filename):
+    '''
+    Load a sequence file. Files ending in .yaml or .yml are read as YAML, all
+    others as JSON.
+
+    A sequence is an object with a list of steps and, optionally, the rate at
+    which to play it:
+
+        {
+            "rate": 200,
+            "steps": [
+                {"ramp": {"axis": "JL_V", "from": 0.0, "to": 0.5, "duration": 1}},
+                {"hold": 30},
+                {"set": {"motor": "HL", "value": 0.2}},
+                {"button": {"button": "UP", "value": 1}},
+                {"repeat": 4, "steps": [...]},
+                {"parallel": [[...], [...]]}
+            ]
+        }
+
+    ramp and set take either an axis or a motor. repeat runs its steps the
+    given number of times. parallel runs each of its lists of steps at the
+    same time and continues once the longest one has finished.
+    '''
+    with open(filename, 'r') as f:
+        if filename.endswith(('.yaml', '.yml')):
+            if yaml is None:
+                raise ValueError("PyYAML is needed to load {}".format(filename))
+
+            return yaml.safe_load(f)
+        else:
+            return json.load(f)
+
+
+def lookup(names, value, kind):
+    if isinstance(value, str):
+        if value not in names:
+            raise ValueError("Unknown {} '{}'".format(kind, value))
+
+        return names[value]
+
+    if int(value) not in names.values():
+        raise ValueError("Unknown {} {}".format(kind, value))
+
+    return int(value)
+
+
+def seconds(value, kind):
+    value = float(value)
+
+    if value < 0.0:
+        raise ValueError("{} can't be negative: {}".format(kind, value))
+
+    return value
+
+
+def target(step):
+    '''
+    Return the input type and index a ramp or set step applies to
+    '''
+    if 'axis' in step:
+        return AXIS, lookup(AXIS_NAMES, step['axis'], "axis")
+    elif 'motor' in step:
+        return MOTOR, lookup(MOTOR_NAMES, step['motor'], "motor")
+    else:
+        raise ValueError("needs an axis or a motor")
+
+
+class StepError(ValueError):
+    '''
+    An invalid step in a sequence. step is the step as it was loaded.
+    '''
+
+    def __init__(self, step, reason):
+        super().__init__("Invalid step {}: {}".format(json.dumps(step), reason))
+        self.step = step
+
+
+def add_steps(schedule, steps):
+    if not isinstance(steps, list):
+        raise ValueError("steps must be a list, not {}".format(json.dumps(steps)))
+
+    for step in steps:
+        if not isinstance(step, dict):
+            raise StepError(step, "a step must be an object")
+
+        try:
+            add_step(schedule, step)
+        except StepError:
+            # a step inside of a repeat or parallel step, already named
+            raise
+        except KeyError as e:
+            raise StepError(step, "missing {}".format(e))
+        except (TypeError, ValueError) as e:
+            raise StepError(step, e)
+
+
+def add_step(schedule, step):
+    if 'ramp' in step:
+        ramp = step['ramp']
+        (type, index) = target(ramp)
+        schedule.ramp(type, index, float(ramp['from']), float(ramp['to']), seconds(ramp['duration'], "duration"))
+    elif 'set' in step:
+        (type, index) = target(step['set'])
+        schedule.set(type, index, float(step['set']['value']))
+    elif 'hold' in step:
+        schedule.hold(seconds(step['hold'], "hold"))
+    elif 'button' in step:
+        button = step['button']
+        schedule.button(lookup(BUTTON_NAMES, button['button'], "button"), int(button.get('value', 1)))
+    elif 'repeat' in step:
+        count = int(step['repeat'])
+
+        if count < 0:
+            raise ValueError("repeat can't be negative: {}".format(count))
+
+        for i in range(count):
+            add_steps(schedule, step['steps'])
+    elif 'parallel' in step:
+        if not isinstance(step['parallel'], list):
+            raise ValueError("parallel needs a list of lists of steps")
+
+        with schedule.together():
+            for steps in step['parallel']:
+                with schedule.branch():
+                    add_steps(schedule, steps)
+    else:
+        raise ValueError("Unknown step")
+
+
+def compile_sequence(data):
+    '''
+    Turn a loaded sequence into a Schedule. Raises ValueError for an invalid
+    sequence, or StepError, which is a ValueError, naming the step that is
+    wrong.
+    '''
+    schedule = Schedule()
+
+    try:
+        steps = data['steps']
+    except (KeyError, TypeError) as e:
+        raise ValueError("Invalid sequence: missing {}".format(e))
+
+    add_steps(schedule, steps)
+
+    return schedule
+
+
+def timeline(data, rate=None):
+    '''
+    Compile a loaded sequence into the complete list of (time, changes)
+    frames to send
+    '''
+    if rate is None:
+        rate = float(data.get('rate', DEFAULT_RATE))
+
+    return list(compile_sequence(data).frames(rate))
+
+
+def dry_run(frames, server_rate=SERVER_RATE):
+    '''
+    Run a timeline through a simulated ThrusterController, stepping it the
+    way the thruster server's control loop does, without waiting for real
+    time to pass. Returns a list of (time, ticks) with the PWM off tick of
+    every channel after each control tick.
+    '''
+    controller = ThrusterController(True)
+    controller.use_limiter = True
+
+    # there's no real bus to wait for
+    controller.motor_controller.pwm.realtime = False
+
+    devices = controller.motor_controller.devices
+    period = 1.0 / server_rate
+    end = frames[-1][0] if frames else 0.0
+    results = []
+    position = 0
+    tick = 0
+
+    while True:
+        t = tick * period
+
+        with controller.batch():
+            while position < len(frames) and frames[position][0] <= t:
+                for (type, index, value) in frames[position][1]:
+                    if type == AXIS:
+                        controller.update_axis(index, value)
+                    elif type == MOTOR:
+                        controller.set_motor(index, value)
+                    elif type == BUTTON:
+                        controller.update_button(index, value)
+
+                position += 1
+
+            if tick > 0:
+                controller.step(period)
+
+        results.append((t, [device.off for device in devices]))
+
+        # keep going until every frame was applied and every thruster has
+        # settled on its final value
+        settled = all(controller.limiter.settled(motor) for motor in range(len(devices)))
+
+        if t >= end and position == len(frames) and settled:
+            break
+
+        tick += 1
+
+    return results
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,169 @@
+import os
+import json
+import threading
+from collections import OrderedDict
+
+
+class SettingsWriter:
+    '''
+    Saves settings files on a background thread so a request never waits on
+    the SD card. Only the latest data for each file is kept, so if the
+    calibration page sends several changes while a write is in progress, only
+    the last one is written.
+
+    Files are written to a temporary file and then renamed over the original,
+    so a reader never sees a partially written file, even if we lose power.
+    '''
+
+    def __init__(self):
+        self.pending = OrderedDict()
+        self.condition = threading.Condition()
+        self.running = True
+        self.written = 0
+        self.thread = threading.Thread(target=self.run, name="settings-writer")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def save(self, filename, data):
+        with self.condition:
+            self.pending[filename] = data
+            self.condition.notify()
+
+    def close(self):
+        '''
+        Write anything still pending, then stop the writer thread
+        '''
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+
+        self.thread.join()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running and len(self.pending) == 0:
+                    self.condition.wait()
+
+                if len(self.pending) == 0:
+                    return
+
+                (filename, data) = self.pending.popitem(last=False)
+
+            try:
+                self.write(filename, data)
+            except (OSError, TypeError, ValueError) as e:
+                print("unable to save settings to {}: {}".format(filename, e))
+
+    def write(self, filename, data):
+        directory = os.path.dirname(filename)
+
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        temporary = filename + ".tmp"
+
+        with open(temporary, 'w') as out:
+            out.write(json.dumps(data, indent=2))
+
+        os.replace(temporary, filename)
+        self.written += 1
+
+
+class ProfileCache:
+    '''
+    Keeps the most recently used named settings profiles in memory, already
+    compiled. Each entry remembers the modification time of its file, so a
+    profile that was changed on disk is loaded again the next time it is
+    used. Checking the modification time is a single stat call, which keeps
+    switching to a cached profile fast enough to do during a dive.
+
+    A profile we are saving ourselves is put in the cache right away, before
+    the file is written in the background, so it is never served stale.
+    '''
+
+    def __init__(self, directory, compile, max_entries=16):
+        self.directory = directory
+        self.compile = compile
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def filename(self, name):
+        '''
+        Return the file a profile is stored in. Raises ValueError for names
+        that would escape the settings directory.
+        '''
+        if name in ("", ".", "..") or os.path.basename(name) != name:
+            raise ValueError("Invalid profile name '{}'".format(name))
+
+        return os.path.join(self.directory, name + ".json")
+
+    def get(self, name):
+        '''
+        Return the compiled profile with the given name, or None if there is
+        no such profile. Raises ValueError if the profile can't be compiled.
+        '''
+        filename = self.filename(name)
+
+        try:
+            mtime = os.stat(filename).st_mtime_ns
+        except OSError:
+            mtime = None
+
+        with self.lock:
+            entry = self.entries.get(name)
+
+            # an entry without a modification time was put here by put and
+            # may not be on disk yet, so it is the newest version there is.
+            # Once we can see the file, we watch it for changes again. If
+            # that is still the old file, the new one is simply loaded again
+            # once it has been written
+            if entry is not None and (entry[0] is None or entry[0] == mtime):
+                if entry[0] is None and mtime is not None:
+                    self.entries[name] = (mtime, entry[1])
+
+                self.entries.move_to_end(name)
+                self.hits += 1
+                return entry[1]
+
+        if mtime is None:
+            self.discard(name)
+            return None
+
+        with open(filename, 'r') as f:
+            profile = self.compile(json.load(f))
+
+        with self.lock:
+            self.misses += 1
+            self.entries[name] = (mtime, profile)
+            self.entries.move_to_end(name)
+
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+        return profile
+
+    def put(self, name, profile):
+        '''
+        Cache a profile that is about to be saved
+        '''
+        with self.lock:
+            self.entries[name] = (None, profile)
+            self.entries.move_to_end(name)
+
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def discard(self, name):
+        with self.lock:
+            self.entries.pop(name, None)
+
+
+if __name__ == "__main__":
+    pass
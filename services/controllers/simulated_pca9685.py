@@ -0,0 +1,189 @@
+import math
+import time
+from collections import deque
+
+
+# Register addresses from the PCA9685 datasheet
+MODE1 = 0x00
+PRESCALE = 0xFE
+LED0_ON_L = 0x06
+REGISTERS_PER_CHANNEL = 4
+CHANNEL_COUNT = 16
+ALL_LED_ON_L = 0xFA
+
+# MODE1 bits
+RESTART = 0x80
+SLEEP = 0x10
+AUTO_INCREMENT = 0x20
+ALLCALL = 0x01
+
+OSCILLATOR_FREQUENCY = 25000000.0
+
+# The Raspberry Pi runs its I2C bus at 100kHz by default. Every byte on the
+# bus takes 9 clocks (8 data bits and an ack), and every write transaction
+# sends the device address and the register address before the data. On top
+# of that, each transaction is a separate system call, which we estimate at
+# 50us on a Pi.
+BUS_FREQUENCY = 100000
+TRANSACTION_OVERHEAD = 0.00005
+
+TIMELINE_SIZE = 100000
+
+
+class SimulatedI2CDevice:
+    '''
+    Stands in for the Adafruit_GPIO I2C device used by the PCA9685 driver.
+    Reads and writes go to an array of registers, and each write takes as long
+    as it would on a real bus.
+    '''
+
+    def __init__(self, chip, bus_frequency=BUS_FREQUENCY, overhead=TRANSACTION_OVERHEAD, realtime=True):
+        self.chip = chip
+        self.bus_frequency = bus_frequency
+        self.overhead = overhead
+        self.realtime = realtime
+        self.registers = bytearray(256)
+        self.registers[MODE1] = SLEEP | ALLCALL
+        self.registers[PRESCALE] = 0x1E
+
+        # counters for the simulated bus
+        self.transactions = 0
+        self.bytes_written = 0
+        self.bus_time = 0.0
+
+    def transaction(self, data_bytes):
+        duration = self.overhead + (2 + data_bytes) * 9.0 / self.bus_frequency
+
+        self.transactions += 1
+        self.bytes_written += data_bytes
+        self.bus_time += duration
+
+        if self.realtime:
+            time.sleep(duration)
+
+    def readU8(self, register):
+        self.transaction(1)
+
+        return self.registers[register]
+
+    def readList(self, register, length):
+        self.transaction(length)
+
+        return bytearray(self.registers[register:register + length])
+
+    def write8(self, register, value):
+        self.transaction(1)
+        self.store(register, [value & 0xFF])
+
+    def writeList(self, register, data):
+        self.transaction(len(data))
+
+        # without auto-increment, every byte lands in the same register
+        if self.registers[MODE1] & AUTO_INCREMENT:
+            self.store(register, data)
+        else:
+            for value in data:
+                self.store(register, [value])
+
+    def store(self, register, data):
+        for (i, value) in enumerate(data):
+            self.registers[(register + i) & 0xFF] = value
+
+        self.chip.registers_changed(register, len(data))
+
+
+class PCA9685:
+    '''
+    An in-process stand-in for Adafruit_PCA9685.PCA9685. It uses the same
+    register writes as the real driver, so PWMController runs exactly the same
+    code with or without hardware. Every change to a channel's output is
+    recorded in timeline as (time, channel, on, off) so tests and benchmarks
+    can see what the thrusters would have done.
+
+    When realtime is True, each bus write sleeps for as long as it would take
+    on a real bus, so latency measurements include the cost of I2C.
+    '''
+
+    def __init__(self, address=0x40, i2c=None, realtime=True, timeline_size=TIMELINE_SIZE, **kwargs):
+        self.address = address
+        self.outputs = [(0, 0)] * CHANNEL_COUNT
+        self.timeline = deque(maxlen=timeline_size)
+        self._device = SimulatedI2CDevice(self, realtime=realtime)
+
+        # the real driver starts by resetting all channels and waking the chip
+        self.set_all_pwm(0, 0)
+        self._device.write8(MODE1, self._device.registers[MODE1] & ~SLEEP)
+
+    @property
+    def realtime(self):
+        return self._device.realtime
+
+    @realtime.setter
+    def realtime(self, value):
+        self._device.realtime = value
+
+    @property
+    def frequency(self):
+        prescale = self._device.registers[PRESCALE]
+
+        return OSCILLATOR_FREQUENCY / 4096.0 / (prescale + 1)
+
+    def set_pwm_freq(self, freq_hz):
+        prescale = int(math.floor(OSCILLATOR_FREQUENCY / 4096.0 / float(freq_hz) - 1.0 + 0.5))
+        old_mode = self._device.readU8(MODE1)
+
+        # the prescaler can only be changed while the chip is asleep
+        self._device.write8(MODE1, (old_mode & 0x7F) | SLEEP)
+        self._device.write8(PRESCALE, prescale)
+        self._device.write8(MODE1, old_mode)
+        self._device.write8(MODE1, old_mode | RESTART)
+
+    def set_pwm(self, channel, on, off):
+        register = LED0_ON_L + REGISTERS_PER_CHANNEL * channel
+
+        self._device.write8(register, on & 0xFF)
+        self._device.write8(register + 1, on >> 8)
+        self._device.write8(register + 2, off & 0xFF)
+        self._device.write8(register + 3, off >> 8)
+
+    def set_all_pwm(self, on, off):
+        self._device.write8(ALL_LED_ON_L, on & 0xFF)
+        self._device.write8(ALL_LED_ON_L + 1, on >> 8)
+        self._device.write8(ALL_LED_ON_L + 2, off & 0xFF)
+        self._device.write8(ALL_LED_ON_L + 3, off >> 8)
+
+    def registers_changed(self, register, length):
+        '''
+        Record the outputs of any channels touched by a register write
+        '''
+        registers = self._device.registers
+
+        if ALL_LED_ON_L <= register < ALL_LED_ON_L + REGISTERS_PER_CHANNEL:
+            # the ALL_LED registers apply to every channel at once
+            on = registers[ALL_LED_ON_L] | (registers[ALL_LED_ON_L + 1] << 8)
+            off = registers[ALL_LED_ON_L + 2] | (registers[ALL_LED_ON_L + 3] << 8)
+
+            for channel in range(CHANNEL_COUNT):
+                base = LED0_ON_L + REGISTERS_PER_CHANNEL * channel
+                registers[base:base + 4] = registers[ALL_LED_ON_L:ALL_LED_ON_L + 4]
+                self.update_output(channel, on, off)
+
+            return
+
+        first = max(0, (register - LED0_ON_L) // REGISTERS_PER_CHANNEL)
+        last = min(CHANNEL_COUNT - 1, (register + length - 1 - LED0_ON_L) // REGISTERS_PER_CHANNEL)
+
+        for channel in range(first, last + 1):
+            base = LED0_ON_L + REGISTERS_PER_CHANNEL * channel
+            on = registers[base] | (registers[base + 1] << 8)
+            off = registers[base + 2] | (registers[base + 3] << 8)
+            self.update_output(channel, on, off)
+
+    def update_output(self, channel, on, off):
+        if self.outputs[channel] != (on, off):
+            self.outputs[channel] = (on, off)
+            self.timeline.append((time.time(), channel, on, off))
+
+
+if __name__ == "__main__":
+    pass
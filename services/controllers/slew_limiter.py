@@ -0,0 +1,74 @@
+import math
+
+
+# Once an output is this close to its target, we jump straight to the target.
+# This is well under one PWM tick, which is 2/250 of the full thrust range,
+# and keeps smoothing from creeping towards a target forever.
+SNAP_DISTANCE = 0.001
+
+
+class SlewLimiter:
+    '''
+    Moves each thruster's output towards its target value a little at a time
+    instead of all at once. step is called at a fixed rate with the time since
+    the last step and returns only the outputs that moved.
+
+    Two limits are applied, each configured per thruster:
+
+    rate - the largest change in thrust per second. Thrust runs from -1 to 1,
+    so a rate of 4.0 takes half a second to go from full reverse to full
+    forward. A rate of 0 means no limit.
+
+    smoothing - the time constant, in seconds, of a low pass filter applied
+    before the rate limit. This rounds off the start of a change and damps
+    jitter in the input. A smoothing of 0 means no filtering.
+    '''
+
+    def __init__(self, count):
+        self.targets = [0.0] * count
+        self.outputs = [0.0] * count
+
+    def set_target(self, index, value):
+        self.targets[index] = value
+
+    def set_output(self, index, value):
+        '''
+        Set an output directly, bypassing the limits. The target is moved too,
+        so the output stays where it was put.
+        '''
+        self.targets[index] = value
+        self.outputs[index] = value
+
+    def settled(self, index):
+        return self.outputs[index] == self.targets[index]
+
+    def step(self, dt, rates, smoothing):
+        changes = []
+
+        for index in range(len(self.targets)):
+            target = self.targets[index]
+            output = self.outputs[index]
+
+            if output == target:
+                continue
+
+            if smoothing[index] > 0.0:
+                new_output = output + (target - output) * (1.0 - math.exp(-dt / smoothing[index]))
+            else:
+                new_output = target
+
+            if rates[index] > 0.0:
+                limit = rates[index] * dt
+                new_output = max(output - limit, min(new_output, output + limit))
+
+            if abs(target - new_output) < SNAP_DISTANCE:
+                new_output = target
+
+            self.outputs[index] = new_output
+            changes.append((index, new_output))
+
+        return changes
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,170 @@
+import os
+import mmap
+import time
+import struct
+
+# NumPy is only needed to load a log for analysis, not to write one
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# A log file starts with a header holding a magic number, the record size and
+# the number of records written so far. Records follow the header back to
+# back.
+MAGIC = b"THRLOG02"
+HEADER = struct.Struct("<8sIIQ8x")
+
+# Each record holds the time the message was processed in seconds since the
+# epoch, the 5-byte message exactly as it arrived (the header byte followed by
+# the float value), the PWM off tick of all six channels after the message
+# was applied, and the value that was applied. The applied value differs from
+# the message only when the server filters axis values, so replaying the
+# applied values reproduces a dive without filtering anything twice. Records
+# are padded to 32 bytes.
+RECORD = struct.Struct("<dBf6Hf3x")
+CHANNEL_COUNT = 6
+
+# The header of a record written because the ticks changed without a message,
+# for example while the slew limiter moves a thruster towards its target. It
+# is a CONTROL message, which is never applied to the thrusters, so it can't
+# be mistaken for one that was. The value and applied value of these records
+# are 0.0.
+NO_MESSAGE = 0xFF
+
+# The log file is grown this many records at a time. Growing the file is the
+# only time writing a record makes a system call.
+GROW_RECORDS = 65536
+
+# The same record layout for NumPy. header and value overlap message, so the
+# message can be used raw or decoded
+if numpy is not None:
+    RECORD_DTYPE = numpy.dtype({
+        'names': ['time', 'message', 'header', 'value', 'ticks', 'applied'],
+        'formats': ['<f8', ('u1', 5), 'u1', '<f4', ('<u2', CHANNEL_COUNT), '<f4'],
+        'offsets': [0, 8, 8, 9, 13, 25],
+        'itemsize': RECORD.size
+    })
+
+
+class TelemetryLog:
+    '''
+    An append-only log of every message the thruster server applies and the
+    PWM ticks that resulted from it. Changes to the ticks that don't come from
+    a message are recorded too, with a NO_MESSAGE header, so the log holds
+    every value sent to the ESCs.
+
+    The file is memory mapped and grown in large steps, so writing a record
+    only copies 32 bytes into memory; the kernel writes the pages to disk in
+    the background. The record count in the header is updated with every
+    record, so a log is readable even if the server is killed without closing
+    it. Closing the log trims the unused space from the end of the file.
+    '''
+
+    def __init__(self, path, grow_records=GROW_RECORDS):
+        self.path = path
+        self.grow_records = grow_records
+        self.count = 0
+        self.capacity = 0
+
+        # the ticks of the last record
+        self.ticks = None
+        self.file = open(path, "w+b")
+        self.map = None
+        self.grow()
+
+    def grow(self):
+        if self.map is not None:
+            self.map.close()
+
+        self.capacity += self.grow_records
+        self.file.truncate(HEADER.size + self.capacity * RECORD.size)
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        HEADER.pack_into(self.map, 0, MAGIC, RECORD.size, 0, self.count)
+
+    def record(self, header, value, ticks, applied=None, timestamp=None):
+        '''
+        Append one record. header is the first byte of the message, value is
+        its float value as it arrived and ticks are the off ticks of the six
+        PWM channels. applied is the value that was applied, if the server
+        changed it.
+        '''
+        if self.count == self.capacity:
+            self.grow()
+
+        if timestamp is None:
+            timestamp = time.time()
+
+        if applied is None:
+            applied = value
+
+        RECORD.pack_into(
+            self.map, HEADER.size + self.count * RECORD.size,
+            timestamp, header, value, *ticks, applied
+        )
+        self.count += 1
+        self.ticks = ticks
+        HEADER.pack_into(self.map, 0, MAGIC, RECORD.size, 0, self.count)
+
+    def record_ticks(self, ticks, timestamp=None):
+        '''
+        Append a NO_MESSAGE record if the ticks differ from the last record
+        '''
+        if ticks != self.ticks:
+            self.record(NO_MESSAGE, 0.0, ticks, 0.0, timestamp)
+
+    def close(self):
+        if self.file is None:
+            return
+
+        self.map.close()
+        self.map = None
+        self.file.truncate(HEADER.size + self.count * RECORD.size)
+        self.file.close()
+        self.file = None
+
+
+def read_header(f):
+    (magic, record_size, reserved, count) = HEADER.unpack(f.read(HEADER.size))
+
+    if magic != MAGIC or record_size != RECORD.size:
+        raise ValueError("Not a telemetry log")
+
+    return count
+
+
+def load(path):
+    '''
+    Load a whole log as a NumPy structured array with the fields time,
+    message, header, value, ticks and applied. The controller, input type and input
+    index can be taken from header with header >> 6, (header >> 4) & 3 and
+    header & 15. Records with a NO_MESSAGE header only show a change in the
+    ticks.
+    '''
+    with open(path, "rb") as f:
+        count = read_header(f)
+
+        return numpy.fromfile(f, dtype=RECORD_DTYPE, count=count)
+
+
+def read_records(path):
+    '''
+    Yield (time, message, ticks, applied) for every record in a log without
+    NumPy
+    '''
+    with open(path, "rb") as f:
+        count = read_header(f)
+        data = f.read(count * RECORD.size)
+
+    for offset in range(0, len(data) - len(data) % RECORD.size, RECORD.size):
+        values = RECORD.unpack_from(data, offset)
+        yield (values[0], data[offset + 8:offset + 13], values[3:-1], values[-1])
+
+
+def log_filename(directory):
+    return os.path.join(directory, "telemetry-{}.log".format(time.strftime("%Y%m%d-%H%M%S")))
+
+
+if __name__ == "__main__":
+    pass
@@ -1,11 +1,9 @@
 #!/usr/bin/env python3
 
 import sys
-import socket
-import time
-from input_types import MOTOR, AXIS, BUTTON
-from message import Message
-from utils import lerp
+from input_types import MOTOR, AXIS, BUTTON, AUTOMATION
+from thruster_connection import ThrusterConnection
+from automation import Schedule, Player, DEFAULT_RATE
 
 
 JL_H = 0  # left joystick horizontal axis
@@ -15,10 +13,15 @@ JR_V = 3  # right joystick vertical axis
 
 HOST = "192.168.0.212"
 PORT = 9999
+PIPELINE = True
+VERBOSE = False
 
-TICK = 1.0 / 60.0
+# the number of times per second we update the thrusters while running the
+# script
+RATE = DEFAULT_RATE
 
-controller = 0
+# the server lets a pilot take over from automation at any time
+controller = AUTOMATION
 
 # process command line args
 for i in range(1, len(sys.argv)):
@@ -26,54 +29,36 @@ for i in range(1, len(sys.argv)):
 
     if arg == "-h" or arg == "--host":
         HOST = sys.argv[i + 1]
+    elif arg == "-n" or arg == "--no-pipeline":
+        PIPELINE = False
+    elif arg == "-r" or arg == "--rate":
+        RATE = float(sys.argv[i + 1])
+    elif arg == "-v" or arg == "--verbose":
+        VERBOSE = True
 
-
-def send_message(controller, type, index, value):
-    m = Message()
-
-    m.controller_index = controller
-    m.input_type = type
-    m.input_index = index
-    m.input_value = value
-
-    if type == AXIS:
-        print("Setting axis {} to {}".format(index, value))
-    elif type == BUTTON:
-        print("Setting button {} to {}".format(index, value))
-
-    s.send(m.byte_convert())
-
-    response = s.recv(1024)
-    decoded_response = response.decode('ascii')
-
-    if decoded_response != "OK":
-        print(decoded_response)
+# The script below only builds a schedule. Nothing is sent until the whole
+# schedule is played at the end, which keeps the timing exact no matter how
+# long sending takes. Use "with together():" to run several ramps at once,
+# and "with branch():" inside of it for a sequence of steps that runs
+# alongside the others.
+schedule = Schedule()
 
 
 def hold(seconds):
-    time.sleep(seconds)
+    schedule.hold(seconds)
 
 
 def ramp(type, index, fromValue, toValue, duration):
-    start = time.time()
-    end = start + duration
-    current = start
+    schedule.ramp(type, index, fromValue, toValue, duration)
 
-    while current <= end:
-        s = (current - start) / duration
-        t = max(0.0, min(s, 1.0))
-        value = lerp(fromValue, toValue, t)
-        send_message(controller, type, index, value)
-        time.sleep(TICK)
-        current = time.time()
 
-    # make sure we end up exactly at our toValue
-    send_message(controller, type, index, toValue)
+def together():
+    return schedule.together()
 
 
-s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-s.connect((HOST, PORT))
-print("Connected to server")
+def branch():
+    return schedule.branch()
+
 
 # for i in range(0, 4):
 #     for MAX_POWER in (0.5, 0.9):
@@ -102,9 +87,22 @@ ramp(AXIS, JR_V, 0.0, 0.0, 1)
 # ramp(AXIS, JR_V, 0.0, 0.0, 2)
 
 # set 50% forward directly
-# send_message(controller, AXIS, JL_V, 0.5)
+# schedule.set(AXIS, JL_V, 0.5)
 # hold(1)
-# send_message(controller, AXIS, JL_V, 0.0)
+# schedule.set(AXIS, JL_V, 0.0)
+
+# pitch and move forward at the same time
+# with together():
+#     ramp(AXIS, JL_V, 0.0, 0.5, 2)
+#     ramp(AXIS, JR_V, 0.0, 0.3, 1)
+
+# move forward while pitching up and back down
+# with together():
+#     ramp(AXIS, JL_V, 0.0, 0.5, 4)
+#     with branch():
+#         ramp(AXIS, JR_V, 0.0, 0.3, 1)
+#         hold(2)
+#         ramp(AXIS, JR_V, 0.3, 0.0, 1)
 
 # move motors forward, then backward
 # NOTE: range is half-open, for example [0, 5)
@@ -120,4 +118,11 @@ ramp(AXIS, JR_V, 0.0, 0.0, 1)
 #     ramp(MOTOR, i, -max_speed, 0.0, duration)
 #     hold(0.5)
 
-s.close()
+connection = ThrusterConnection(HOST, PORT, PIPELINE)
+print("Connected to server")
+
+player = Player(connection, controller, VERBOSE)
+player.play(schedule.frames(RATE))
+print(player.report())
+
+connection.close()
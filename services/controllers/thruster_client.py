@@ -1,11 +1,12 @@
 #!/usr/bin/env python3
 
 import sys
-import socket
 import atexit
 import pygame
-from input_types import AXIS, BUTTON
-from message import Message
+from input_types import AXIS, BUTTON, PILOT
+from thruster_connection import ThrusterConnection
+from input_sender import InputSender
+from axis_filter import load_filter, FILTER_FILE, SETTLE_TIME
 import platform
 
 
@@ -73,6 +74,13 @@ else:
 #host = "192.168.2.1"
 host = "192.168.0.207"
 port = 9999
+pipeline = True
+
+# How long we wait for a controller event before checking whether we should
+# stop, in milliseconds. While the axis filter is holding back a value, we
+# wake up often enough to send it once the axis settles
+EVENT_TIMEOUT = 250
+SETTLE_TIMEOUT = int(SETTLE_TIME * 1000 / 2)
 
 # process command line args
 for i in range(1, len(sys.argv)):
@@ -80,11 +88,26 @@ for i in range(1, len(sys.argv)):
 
     if arg == "-h" or arg == "--host":
         host = sys.argv[i + 1]
-
-# create a socket object and connect to specified host/port
-s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-s.connect((host, port))
+    elif arg == "-n" or arg == "--no-pipeline":
+        pipeline = False
+    elif arg == "-f" or arg == "--filter":
+        FILTER_FILE = sys.argv[i + 1]
+
+# create a connection to the specified host/port. Unless we're told not to,
+# the connection pipelines messages so we don't wait for a round trip after
+# every controller event.
+connection = ThrusterConnection(host, port, pipeline)
 print("Connected to server")
+if connection.pipelined:
+    print("Pipelining messages")
+
+# controller values are sent from a background thread, so reading the
+# controller never waits on the network
+sender = InputSender(connection)
+
+# drop axis values that are only controller noise before they are sent. See
+# axis_filter.py for the settings
+axis_filter = load_filter(FILTER_FILE)
 
 
 def close_socket():
@@ -93,47 +116,23 @@ def close_socket():
     that we cleanly close all sockets we opened in this script. Simply close
     the socket to free any system level resources we are using.
     '''
-    s.close()
+    sender.close()
+    connection.close()
+
+    print("Axis values sent: {}, filtered out: {}".format(axis_filter.passed, axis_filter.suppressed))
 
 
 def send_message(controller, type, index, value):
     '''
-    Send a message to the server
+    Queue a message for the server. The sender thread sends it on its next
+    tick, unless a newer value for the same axis replaces it first.
 
     controller indicates which controller this message comes from
     type indicates what kind of input we got from the controller
     index indicates which input of the given type is sending the message
     value indicates the value of the input
     '''
-
-    # Create an instance of a helper class that will pack and unpack our message
-    # data for us.
-    m = Message()
-
-    # set all of the values on our helper class
-    m.controller_index = controller
-    m.input_type = type
-    m.input_index = index
-    m.input_value = value
-
-    # convert the message to a byte array and send it to the server
-    s.send(m.byte_convert())
-
-    # We wait for a response from the server to acknowledge it was received.
-    # Note that in order to make this code more robust, we should use some sort
-    # of timeout here so our code does not hang upon failure to receive a
-    # response
-    response = s.recv(1024)
-
-    # We expect a plaintext reponse, so convert the response to ASCII
-    decoded_response = response.decode('ascii')
-
-    # if the response is 'OK', then all is good. Note that we are not handling
-    # non 'OK' responses. This code needs to be improved for better error
-    # handling. For now we just print 'OK' to give some feedback to us humans
-    # that communication appears to be working.
-    if decoded_response != "OK":
-        print(decoded_response)
+    sender.put(controller, type, index, value)
 
 
 # make sure to close our socket when the script exits
@@ -166,7 +165,8 @@ done = False
 # make it clear which controller is sending data the server. It's much easier
 # to understand what "controller" refers to in later code as opposed to the
 # magic number 0. This number must be a value in the closed interval [0,3].
-controller = 0
+# The server gives the PILOT controller priority over everything else.
+controller = PILOT
 
 # There are different types of input that can be generated from a controller:
 # axis data, buttons, etc. We only care about joystick data (axis data) for the
@@ -177,10 +177,18 @@ controller = 0
 # This number must be a value in the closed interval [0,3].
 type = 0
 
+# Only wake up for the events we use
+pygame.event.set_blocked(None)
+pygame.event.set_allowed([pygame.QUIT, pygame.JOYAXISMOTION, pygame.JOYBUTTONDOWN, pygame.JOYBUTTONUP])
+
 # Process controller input until we're told to quit
 while done is False:
-    # Wait until we get some input from a controller
-    for event in pygame.event.get():
+    # Sleep until we get some input from a controller. The timeout makes sure
+    # we still notice if we've been told to quit
+    event = pygame.event.wait(SETTLE_TIMEOUT if axis_filter.held else EVENT_TIMEOUT)
+
+    # handle everything that arrived while we were asleep before waiting again
+    for event in [event] + pygame.event.get():
         value = None
 
         if event.type == pygame.QUIT:
@@ -195,7 +203,10 @@ while done is False:
                 index = AXIS_MAP[event.axis]
             else:
                 index = event.axis
-            value = round(event.value, PRECISION)
+            value = axis_filter.filter(controller, index, round(event.value, PRECISION))
+
+            if value is not None:
+                value = round(value, PRECISION)
         elif event.type == pygame.JOYBUTTONDOWN:
             type = BUTTON
             value = 1
@@ -214,3 +225,7 @@ while done is False:
         # if we got a new value, then send it to the server
         if value is not None:
             send_message(controller, type, index, value)
+
+    # send values the filter held back once their axes stop moving
+    for (controller_index, index, value) in axis_filter.settled():
+        send_message(controller_index, AXIS, index, round(value, PRECISION))
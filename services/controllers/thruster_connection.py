@@ -0,0 +1,198 @@
+import select
+import socket
+import time
+from collections import deque
+from input_types import CONTROL
+from message_3 import Message, MessageDecoder, PIPELINE, ACK, SEQUENCE_MODULUS
+
+
+# The maximum number of messages we allow to be sent but not yet acknowledged
+# by the server when pipelining. This bounds how far the thrusters can lag
+# behind the controller if the network stalls.
+DEFAULT_WINDOW = 32
+
+
+class ThrusterConnection:
+    '''
+    A connection to the thruster server.
+
+    By default we ask the server to pipeline messages. In that mode we send
+    messages without waiting for a response, and the server periodically
+    acknowledges how many messages it has processed. We only block when the
+    number of unacknowledged messages reaches the window size. If the server
+    does not support pipelining, it answers our request with a plain "OK" and
+    we fall back to waiting for an "OK" after every message.
+    '''
+
+    def __init__(self, host, port, pipeline=True, window=DEFAULT_WINDOW):
+        self.socket = socket.create_connection((host, port))
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.window = window
+        self.pipelined = False
+        self.decoder = MessageDecoder()
+
+        # send times of the messages the server has not acknowledged yet,
+        # oldest first
+        self.in_flight = deque()
+        self.acked = 0
+
+        # bytes accepted by send_nowait that the socket could not take yet
+        self.outgoing = bytearray()
+
+        # when set to a list, the round trip time of every acknowledged
+        # message is appended to it
+        self.latencies = None
+
+        if pipeline:
+            self.negotiate()
+
+    def negotiate(self):
+        request = Message.create(0, CONTROL, PIPELINE, float(self.window))
+        self.socket.sendall(bytes(request))
+
+        response = b""
+
+        while len(response) < len("OK"):
+            data = self.socket.recv(1024)
+
+            if data == b"":
+                raise ConnectionError("server closed the connection")
+
+            response += data
+
+        if response.startswith(b"OK"):
+            # an older server that processed our request as an ordinary
+            # message, so it does not know how to pipeline
+            self.pipelined = False
+        else:
+            self.pipelined = True
+            self.receive_acks(response)
+
+            while self.decoder.pending > 0:
+                self.read_acks(None)
+
+    def send(self, controller, type, index, value):
+        m = Message.create(controller, type, index, value)
+
+        if self.pipelined:
+            self.socket.sendall(bytes(m))
+            self.in_flight.append(time.perf_counter())
+
+            # pick up any acks that have already arrived without blocking,
+            # then wait only if the window is full
+            self.read_acks(0.0)
+
+            while len(self.in_flight) >= self.window:
+                self.read_acks(None)
+        else:
+            start = time.perf_counter()
+            self.socket.sendall(bytes(m))
+
+            # We wait for a response from the server to acknowledge it was
+            # received.
+            response = self.socket.recv(1024)
+
+            if self.latencies is not None:
+                self.latencies.append(time.perf_counter() - start)
+
+            # We expect a plaintext reponse, so convert the response to ASCII
+            decoded_response = response.decode('ascii')
+
+            # if the response is 'OK', then all is good. Otherwise, show the
+            # response to the humans
+            if decoded_response != "OK":
+                print(decoded_response)
+
+    def send_nowait(self, messages):
+        '''
+        Queue as many messages as the pipelining window allows and send what
+        the socket will take right now, without ever blocking. Returns the
+        number of messages accepted. Messages that were not accepted should
+        be offered again later, by which time newer values may have replaced
+        them. This only works on a pipelined connection.
+        '''
+        self.read_acks(0.0)
+
+        accepted = 0
+
+        for m in messages:
+            if len(self.in_flight) >= self.window:
+                break
+
+            self.outgoing.extend(bytes(m))
+            self.in_flight.append(time.perf_counter())
+            accepted += 1
+
+        self.write_outgoing()
+
+        return accepted
+
+    def write_outgoing(self):
+        if len(self.outgoing) == 0:
+            return
+
+        (_, writable, _) = select.select([], [self.socket], [], 0.0)
+
+        if writable:
+            sent = self.socket.send(self.outgoing)
+            del self.outgoing[:sent]
+
+    def read_acks(self, timeout):
+        '''
+        Process acks from the server. A timeout of None waits until at least
+        some data arrives, 0.0 only processes data that is already available.
+        '''
+        (readable, _, _) = select.select([self.socket], [], [], timeout)
+
+        if readable:
+            data = self.socket.recv(1024)
+
+            if data == b"":
+                raise ConnectionError("server closed the connection")
+
+            self.receive_acks(data)
+
+    def receive_acks(self, data):
+        for m in self.decoder.feed(data):
+            if m.input_type == CONTROL and m.input_index == ACK:
+                acked = int(m.input_value)
+                count = (acked - self.acked) % SEQUENCE_MODULUS
+                self.acked = acked
+                now = time.perf_counter()
+
+                for i in range(min(count, len(self.in_flight))):
+                    sent = self.in_flight.popleft()
+
+                    if self.latencies is not None:
+                        self.latencies.append(now - sent)
+
+    def flush(self, timeout=1.0):
+        '''
+        Wait until the server has acknowledged every message we sent, giving up
+        after timeout seconds
+        '''
+        end = time.perf_counter() + timeout
+
+        if self.outgoing:
+            self.socket.sendall(self.outgoing)
+            self.outgoing = bytearray()
+
+        while self.in_flight:
+            remaining = end - time.perf_counter()
+
+            if remaining <= 0.0:
+                return False
+
+            self.read_acks(remaining)
+
+        return True
+
+    def close(self):
+        if self.pipelined:
+            self.flush()
+
+        self.socket.close()
+
+
+if __name__ == "__main__":
+    pass
@@ -1,7 +1,11 @@
 import os
 import json
+from contextlib import contextmanager
 from vector2d import Vector2D
 from interpolator import Interpolator
+from mixing_table import MixingTable
+from settings_store import SettingsWriter, ProfileCache
+from slew_limiter import SlewLimiter
 from utils import map_range
 
 
@@ -33,6 +37,7 @@ VC = 2  # vertical center
 VR = 3  # vertical right
 HR = 4  # horizontal right
 LIGHT = 5
+MOTOR_COUNT = 6
 
 # Define a series of constants, one for each game controller axis
 JL_H = 0  # left joystick horizontal axis
@@ -53,8 +58,156 @@ NEUTRAL = 369
 FULL_FORWARD = 496
 LIGHT_STEP = 0.05
 
-# Use this file to load/store thruster and sensitivity settings
+# Use this file to load/store thruster and sensitivity settings. Named
+# profiles are stored in SETTINGS_DIR
 SETTINGS_FILE = 'thruster_settings.json'
+SETTINGS_DIR = 'settings'
+
+# These settings are used when there is no settings file.
+#
+# The sensitivity strength is applied to each thruster. 0 indicates a linear
+# response which is the default when no sensitivity is applied. 1 indicates
+# full sensitivity. Values between 0 and 1 can be used to increase and to
+# decrease the overall sensitivity. Increasing sensivity dampens lower values
+# and amplifies larger values giving more precision at lower power levels.
+#
+# We use a cubic to apply sensitivity. If you find that full sensitivity
+# (dampening) does not give you fine enough control, you can increase the
+# degree of the polynomial used for dampening. Note that the power must be a
+# positive odd number. Any other values will cause unexpected results.
+#
+# Each thruster has an interpolator, in HL, VL, VC, VR, HR order. Each item in
+# an interpolator is a pair of values stored one after the other: an angle in
+# degrees and a thrust value. An interpolator works by returning a value for
+# any given input value. More specifically in this case, we will give each
+# interpolator an angle and it will return a thrust value for that angle.
+# Since we have only given the interpolator values for very specific angles,
+# it will have to determine values for angles we have not provided. It does
+# this using linear interpolation.
+#
+# Slew limits are given for each motor in HL, VL, VC, VR, HR, LIGHT order and
+# are only applied when the thruster server runs a control loop. The rates
+# are the largest change in thrust per second, so 4.0 takes half a second to
+# go from full reverse to full forward. This keeps a flick of a joystick from
+# drawing enough current to brown out the Pi. Smoothing is the time constant
+# in seconds of a low pass filter applied before the rate limit. A value of 0
+# turns either limit off. See SlewLimiter for details.
+DEFAULT_SETTINGS = {
+    'version': 1,
+    'name': '',
+    'sensitivity': {
+        'strength': 0.7,
+        'power': 3
+    },
+    'thrusters': [
+        [0.0, -1.0, 90.0, 1.0, 180.0, 1.0, 270.0, -1.0, 360.0, -1.0],
+        [0.0, 1.0, 90.0, -1.0, 180.0, -1.0, 270.0, 1.0, 360.0, 1.0],
+        [0.0, 0.0, 90.0, 1.0, 180.0, 0.0, 270.0, -1.0, 360.0, 0.0],
+        [0.0, -1.0, 90.0, -1.0, 180.0, 1.0, 270.0, 1.0, 360.0, -1.0],
+        [0.0, 1.0, 90.0, 1.0, 180.0, -1.0, 270.0, -1.0, 360.0, 1.0]
+    ],
+    'slew': {
+        'rates': [4.0, 4.0, 4.0, 4.0, 4.0, 0.0],
+        'smoothing': [0.0, 0.0, 0.0, 0.0, 0.0, 0.0]
+    }
+}
+
+
+class ThrusterSettings:
+    '''
+    A compiled, read-only set of thruster and sensitivity settings.
+
+    Everything update_axis needs is built here, before the settings are put
+    into use. ThrusterController switches settings by replacing its single
+    reference to one of these objects, so the control loop always sees
+    either all of the old settings or all of the new ones, never a mix of
+    the two. Nothing in here may be changed once it has been created. To
+    change settings, create a new instance.
+    '''
+
+    def __init__(self, data):
+        if not isinstance(data, dict):
+            raise ValueError("Invalid settings: expected an object")
+
+        if data.get('version') != 1:
+            raise ValueError("Unsupported data version number '{}'".format(data.get('version')))
+
+        try:
+            self.name = data.get('name', '')
+
+            if not isinstance(self.name, str):
+                raise TypeError("name must be a string")
+
+            self.sensitivity = float(data['sensitivity']['strength'])
+            self.power = float(data['sensitivity']['power'])
+
+            interpolators = []
+
+            for array in data['thrusters'][:5]:
+                interpolator = Interpolator()
+                interpolator.from_array(array)
+                interpolators.append(interpolator)
+
+            # older settings files don't have slew limits, so they get the
+            # defaults
+            slew = data.get('slew', DEFAULT_SETTINGS['slew'])
+            self.slew_rates = tuple(float(rate) for rate in slew['rates'])
+            self.slew_smoothing = tuple(float(smoothing) for smoothing in slew['smoothing'])
+        except (KeyError, IndexError, TypeError) as e:
+            raise ValueError("Invalid settings: {}".format(e))
+
+        if len(interpolators) != 5:
+            raise ValueError("Invalid settings: expected 5 thrusters")
+
+        if len(self.slew_rates) != MOTOR_COUNT or len(self.slew_smoothing) != MOTOR_COUNT:
+            raise ValueError("Invalid settings: expected {} slew limits".format(MOTOR_COUNT))
+
+        # which motors have any limit at all
+        self.slewing = tuple(
+            rate > 0.0 or smoothing > 0.0
+            for (rate, smoothing) in zip(self.slew_rates, self.slew_smoothing)
+        )
+
+        self.interpolators = tuple(interpolators)
+        self.horizontal_left = interpolators[HL]
+        self.vertical_left = interpolators[VL]
+        self.vertical_center = interpolators[VC]
+        self.vertical_right = interpolators[VR]
+        self.horizontal_right = interpolators[HR]
+
+        # create mixing tables. Each table maps a joystick position to the
+        # thrust values of all thrusters controlled by that joystick, using
+        # curves sampled by angle, so we don't have to search the curves for
+        # every event. The tables are built in
+        # full right here and belong to these settings, so they never change.
+        # Curves that don't cover the whole circle raise a ValueError.
+        self.horizontal_mix = MixingTable((
+            self.horizontal_left,
+            self.horizontal_right
+        ))
+        self.vertical_mix = MixingTable((
+            self.vertical_center,
+            self.vertical_left,
+            self.vertical_right
+        ))
+
+    def apply_sensitivity(self, value):
+        return self.sensitivity * value**self.power + (1.0 - self.sensitivity) * value
+
+    def to_data(self):
+        return {
+            'version': 1,
+            'name': self.name,
+            'sensitivity': {
+                'strength': self.sensitivity,
+                'power': self.power
+            },
+            'thrusters': [interpolator.to_array() for interpolator in self.interpolators],
+            'slew': {
+                'rates': list(self.slew_rates),
+                'smoothing': list(self.slew_smoothing)
+            }
+        }
 
 
 class ThrusterController:
@@ -72,88 +225,40 @@ class ThrusterController:
         # be able to shuffle on/off times to even out the current draw from the
         # thrusters, but so far, that hasn't been an issue. It's even possible
         # that the PWM controller may do that for us already.
-        if simulate is False:
-            from pwm_controller import PWMController
-
-            self.motor_controller = PWMController()
-            self.motor_controller.add_device("HL", HL, 0, NEUTRAL)
-            self.motor_controller.add_device("VL", VL, 0, NEUTRAL)
-            self.motor_controller.add_device("VC", VC, 0, NEUTRAL)
-            self.motor_controller.add_device("VR", VR, 0, NEUTRAL)
-            self.motor_controller.add_device("HR", HR, 0, NEUTRAL)
-            self.motor_controller.add_device("LIGHT", LIGHT, 0, FULL_REVERSE)
-        else:
-            self.motor_controller = None
+        #
+        # When simulating, the PWM controller talks to a simulated PCA9685, so
+        # we still run all of the same code as we do on the vehicle.
+        from pwm_controller import PWMController
+
+        self.motor_controller = PWMController(simulate)
+        self.motor_controller.add_device("HL", HL, 0, NEUTRAL)
+        self.motor_controller.add_device("VL", VL, 0, NEUTRAL)
+        self.motor_controller.add_device("VC", VC, 0, NEUTRAL)
+        self.motor_controller.add_device("VR", VR, 0, NEUTRAL)
+        self.motor_controller.add_device("HR", HR, 0, NEUTRAL)
+        self.motor_controller.add_device("LIGHT", LIGHT, 0, FULL_REVERSE)
 
         # setup the joysticks. We use a 2D vector to represent the x and y
         # values of the joysticks.
         self.j1 = Vector2D()
         self.j2 = Vector2D()
 
-        # create interpolators
-        self.horizontal_left = Interpolator()
-        self.vertical_left = Interpolator()
-        self.vertical_center = Interpolator()
-        self.vertical_right = Interpolator()
-        self.horizontal_right = Interpolator()
+        # setup interpolators from a file or use the defaults. Named profiles
+        # are compiled once and cached, and settings are saved in the
+        # background
+        self.settings_writer = SettingsWriter()
+        self.profiles = ProfileCache(SETTINGS_DIR, ThrusterSettings)
+        self.settings = ThrusterSettings(DEFAULT_SETTINGS)
 
-        # setup interpolators from a file or manually
         if os.path.isfile(SETTINGS_FILE):
             with open(SETTINGS_FILE, 'r') as f:
                 self.set_settings(json.load(f), False)
-        else:
-            # Set the sensitivity to be applied to each thruster. 0 indicates a
-            # linear response which is the default when no sensitivity is applied. 1
-            # indicates full sensitivity. Values between 0 and 1 can be used to
-            # increase and to decrease the overall sensitivity. Increasing sensivity
-            # dampens lower values and amplifies larger values giving more precision
-            # at lower power levels.
-            self.sensitivity = 0.7
-
-            # We use a cubic to apply sensitivity. If you find that full sensitivity
-            # (dampening) does not give you fine enough control, you can increase\
-            # the degree of the polynomial used for dampening. Note that this must
-            # be a positive odd number. Any other values will cause unexpected
-            # results.
-            self.power = 3
-
-            # setup the various interpolators for each thruster. Each item we add
-            # to the interpolator consists of two values: an angle in degrees and a
-            # thrust value. An interpolator works by returning a value for any given
-            # input value. More specifically in this case, we will give each
-            # interpolator an angle and it will return a thrust value for that
-            # angle. Since we have only given the interpolator values for very
-            # specific angles, it will have to determine values for angles we have
-            # not provided. It does this using linear interpolation.
-            self.horizontal_left.addIndexValue(0.0, -1.0)
-            self.horizontal_left.addIndexValue(90.0, 1.0)
-            self.horizontal_left.addIndexValue(180.0, 1.0)
-            self.horizontal_left.addIndexValue(270.0, -1.0)
-            self.horizontal_left.addIndexValue(360.0, -1.0)
-
-            self.vertical_left.addIndexValue(0.0, 1.0)
-            self.vertical_left.addIndexValue(90.0, -1.0)
-            self.vertical_left.addIndexValue(180.0, -1.0)
-            self.vertical_left.addIndexValue(270.0, 1.0)
-            self.vertical_left.addIndexValue(360.0, 1.0)
-
-            self.vertical_center.addIndexValue(0.0, 0.0)
-            self.vertical_center.addIndexValue(90.0, 1.0)
-            self.vertical_center.addIndexValue(180.0, 0.0)
-            self.vertical_center.addIndexValue(270.0, -1.0)
-            self.vertical_center.addIndexValue(360.0, 0.0)
-
-            self.vertical_right.addIndexValue(0.0, -1.0)
-            self.vertical_right.addIndexValue(90.0, -1.0)
-            self.vertical_right.addIndexValue(180.0, 1.0)
-            self.vertical_right.addIndexValue(270.0, 1.0)
-            self.vertical_right.addIndexValue(360.0, -1.0)
-
-            self.horizontal_right.addIndexValue(0.0, 1.0)
-            self.horizontal_right.addIndexValue(90.0, 1.0)
-            self.horizontal_right.addIndexValue(180.0, -1.0)
-            self.horizontal_right.addIndexValue(270.0, -1.0)
-            self.horizontal_right.addIndexValue(360.0, 1.0)
+
+        # setup the slew limiter. It only works when something calls step at
+        # a fixed rate, so it stays off until the owner of the control loop
+        # turns it on. Until then, motor changes are applied immediately
+        self.limiter = SlewLimiter(MOTOR_COUNT)
+        self.use_limiter = False
 
         # setup ascent/descent controllers
         self.ascent = -1.0
@@ -169,20 +274,41 @@ class ThrusterController:
         the vehicle could have thrusters running when we don't have scripts
         running to control it.
         '''
-        self.set_motor(HL, 0.0)
-        self.set_motor(VL, 0.0)
-        self.set_motor(VC, 0.0)
-        self.set_motor(VR, 0.0)
-        self.set_motor(HR, 0.0)
+        self.turn_off_motors()
 
         print ('off')
 
     def turn_off_motors(self):
-        self.set_motor(HL, 0.0)
-        self.set_motor(VL, 0.0)
-        self.set_motor(VC, 0.0)
-        self.set_motor(VR, 0.0)
-        self.set_motor(HR, 0.0)
+        '''
+        Stop all thrusters right away. This bypasses the slew limiter, since
+        we use this when we lose a client or shut down and may not get another
+        control tick.
+
+        The joysticks and triggers go back to rest too, so the next input
+        from any controller is applied in full.
+        '''
+        self.j1 = Vector2D()
+        self.j2 = Vector2D()
+        self.ascent = -1.0
+        self.descent = -1.0
+
+        with self.batch():
+            for motor in (HL, VL, VC, VR, HR):
+                self.limiter.set_output(motor, 0.0)
+                self.write_motor(motor, 0.0)
+
+    @contextmanager
+    def batch(self):
+        '''
+        Group motor changes so they are sent to the PWM controller in a single
+        bus transaction. This makes sure the vehicle never runs with only some
+        of the thrusters updated.
+        '''
+        if self.motor_controller is None:
+            yield
+        else:
+            with self.motor_controller.batch():
+                yield
 
     def update_axis(self, axis, value):
         '''
@@ -272,24 +398,26 @@ class ThrusterController:
             pass
             # print("unknown axis ", event.axis)
 
-        # updating horizontal thrusters is easy: find current angle, convert
-        # angle to thruster values, apply values
+        # updating horizontal thrusters is easy: look up the thruster values
+        # for the current joystick position, apply values. The mixing table
+        # takes care of converting the position to an angle and a power
+        #
+        # We only look at self.settings once, so if the settings are switched
+        # while we're working, this update still uses one consistent set
+        settings = self.settings
+
         if update_horizontal_thrusters:
-            left_value = self.horizontal_left.valueAtIndex(self.j1.angle)
-            right_value = self.horizontal_right.valueAtIndex(self.j1.angle)
-            power = min(1.0, self.j1.length)
-            self.set_motor(HL, left_value * power)
-            self.set_motor(HR, right_value * power)
+            left_value, right_value = settings.horizontal_mix.values(self.j1.x, self.j1.y)
+            with self.batch():
+                self.set_motor(HL, left_value, settings)
+                self.set_motor(HR, right_value, settings)
 
         # updating vertical thrusters is trickier. We do the same as above, but
         # then post-process the values if we are applying vertical up/down
         # thrust. As mentioned above, we have to be careful to stay within our
         # [-1,1] interval.
         if update_vertical_thrusters:
-            power = min(1.0, self.j2.length)
-            back_value = self.vertical_center.valueAtIndex(self.j2.angle) * power
-            front_left_value = self.vertical_left.valueAtIndex(self.j2.angle) * power
-            front_right_value = self.vertical_right.valueAtIndex(self.j2.angle) * power
+            (back_value, front_left_value, front_right_value) = settings.vertical_mix.values(self.j2.x, self.j2.y)
             if self.ascent != -1.0:
                 percent = (1.0 + self.ascent) / 2.0
                 max_thrust = max(back_value, front_left_value, front_right_value)
@@ -304,9 +432,10 @@ class ThrusterController:
                 # back_value -= max_adjust
                 front_left_value -= max_adjust
                 front_right_value -= max_adjust
-            self.set_motor(VC, back_value)
-            self.set_motor(VL, front_left_value)
-            self.set_motor(VR, front_right_value)
+            with self.batch():
+                self.set_motor(VC, back_value, settings)
+                self.set_motor(VL, front_left_value, settings)
+                self.set_motor(VR, front_right_value, settings)
 
     def update_button(self, button, value):
         if button == UP:
@@ -320,56 +449,111 @@ class ThrusterController:
         # print("button %s, light = %s, light_value = %s" % (button, self.light, light_value))
         self.set_motor(LIGHT, light_value)
 
-    def set_motor(self, motor_number, value):
+    def set_motor(self, motor_number, value, settings=None):
+        if settings is None:
+            settings = self.settings
+
+        value = settings.apply_sensitivity(value)
+
+        # a limited motor moves towards its new value on the next steps.
+        # Otherwise, we apply the new value right away
+        if self.use_limiter and settings.slewing[motor_number]:
+            self.limiter.set_target(motor_number, value)
+        else:
+            self.limiter.set_output(motor_number, value)
+            self.write_motor(motor_number, value)
+
+    def write_motor(self, motor_number, value):
         if self.motor_controller is not None:
             motor = self.motor_controller.devices[motor_number]
-            value = self.apply_sensitivity(value)
             pwm_value = int(map_range(value, -1.0, 1.0, FULL_REVERSE, FULL_FORWARD))
 
             # print("setting motor {0} to {1}".format(motor_number, pwm_value))
+            # the PWM controller only writes when the tick actually changes,
+            # so small steps cost nothing on the bus
             motor.off = pwm_value
 
+    def step(self, dt):
+        '''
+        Move limited motors towards their targets by dt seconds worth of
+        change. This should be called at a fixed rate while use_limiter is
+        set.
+        '''
+        settings = self.settings
+        changes = self.limiter.step(dt, settings.slew_rates, settings.slew_smoothing)
+
+        if changes:
+            with self.batch():
+                for (motor_number, value) in changes:
+                    self.write_motor(motor_number, value)
+
     def apply_sensitivity(self, value):
-        return self.sensitivity * value**self.power + (1.0 - self.sensitivity) * value
+        return self.settings.apply_sensitivity(value)
+
+    def evaluate(self, j1_x, j1_y, j2_x, j2_y, ascent=-1.0, descent=-1.0):
+        '''
+        Calculate the thruster values and PWM ticks for many controller states
+        at once using the current settings, without changing any thrusters.
+        See thruster_response.evaluate for details.
+        '''
+        from thruster_response import evaluate_curves
+
+        # use the interpolators these settings were compiled with rather than
+        # building new ones
+        settings = self.settings
+
+        return evaluate_curves(
+            settings.interpolators, settings.sensitivity, settings.power,
+            j1_x, j1_y, j2_x, j2_y, ascent, descent
+        )
 
     def get_settings(self):
-        return {
-            'version': 1,
-            'sensitivity': {
-                'strength': self.sensitivity,
-                'power': self.power
-            },
-            'thrusters': [
-                self.horizontal_left.to_array(),
-                self.vertical_left.to_array(),
-                self.vertical_center.to_array(),
-                self.vertical_right.to_array(),
-                self.horizontal_right.to_array()
-            ]
-        }
+        return self.settings.to_data()
 
     def set_settings(self, data, save=True):
-        if data['version'] == 1:
-            # save settings for future loading
-            if save:
-                if data['name'] == "":
-                    filename = SETTINGS_FILE
-                else:
-                    filename = os.path.join("settings", data['name'] + ".json")
-
-                with open(filename, 'w') as out:
-                    out.write(json.dumps(data, indent=2))
-
-            # update current settings
-            self.sensitivity = float(data['sensitivity']['strength'])
-            self.power = float(data['sensitivity']['power'])
-            self.horizontal_left.from_array(data['thrusters'][0])
-            self.vertical_left.from_array(data['thrusters'][1])
-            self.vertical_center.from_array(data['thrusters'][2])
-            self.vertical_right.from_array(data['thrusters'][3])
-            self.horizontal_right.from_array(data['thrusters'][4])
-        else:
-            print("Unsupported data version number '{}'".format(data['version']))
+        # compile the new settings and work out where they go before touching
+        # the current ones. If anything is wrong, we keep running with what we
+        # have
+        try:
+            settings = ThrusterSettings(data)
+
+            if settings.name == "":
+                filename = SETTINGS_FILE
+            else:
+                filename = self.profiles.filename(settings.name)
+        except ValueError as e:
+            print(e)
+            return False
+
+        # switch to the new settings. This is a single assignment, so
+        # update_axis sees either the old settings or the new ones
+        self.settings = settings
+
+        # save settings for future loading. A named profile goes into the
+        # profile cache too, so it is used from there even before the file has
+        # been written
+        if save:
+            if settings.name != "":
+                self.profiles.put(settings.name, settings)
+
+            self.settings_writer.save(filename, data)
+
+        return True
+
+    def use_profile(self, name):
+        '''
+        Switch to a named profile from SETTINGS_DIR. Profiles that have been
+        used before are already compiled, so this is very quick. Returns False
+        if there is no profile with that name.
+        '''
+        settings = self.profiles.get(name)
+
+        if settings is None:
+            return False
+
+        self.settings = settings
+
+        return True
 
 
 if __name__ == "__main__":
@@ -0,0 +1,254 @@
+import math
+from interpolator import Interpolator
+from vector2d import Vector2D
+from thruster_controller import PRECISION, HL, VL, VC, VR, HR, FULL_REVERSE, FULL_FORWARD
+from utils import map_range
+
+# NumPy is optional. Without it, evaluate falls back to evaluating one point at
+# a time, which is fine for a handful of points but far too slow for a full
+# response surface.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+THRUSTER_COUNT = 5
+
+
+def make_interpolators(settings):
+    interpolators = []
+
+    for array in settings['thrusters']:
+        interpolator = Interpolator()
+        interpolator.from_array(array)
+        interpolators.append(interpolator)
+
+    return interpolators
+
+
+def evaluate(settings, j1_x, j1_y, j2_x, j2_y, ascent=-1.0, descent=-1.0):
+    '''
+    Calculate the thruster values and PWM ticks for many controller states at
+    once, using the same math as ThrusterController.update_axis,
+    apply_sensitivity and set_motor. settings uses the same format as
+    ThrusterController.get_settings. Nothing is sent to the thrusters.
+
+    The inputs may be scalars or arrays of any shape that broadcast together,
+    for example a grid made with numpy.meshgrid. This returns a pair of arrays,
+    values and ticks, each with a first dimension of THRUSTER_COUNT indexed by
+    HL, VL, VC, VR and HR followed by the broadcast shape of the inputs.
+
+    Without NumPy, the inputs must be scalars or one dimensional sequences and
+    the results are nested lists.
+    '''
+    return evaluate_curves(
+        make_interpolators(settings),
+        float(settings['sensitivity']['strength']),
+        float(settings['sensitivity']['power']),
+        j1_x, j1_y, j2_x, j2_y, ascent, descent
+    )
+
+
+def evaluate_curves(interpolators, strength, power, j1_x, j1_y, j2_x, j2_y, ascent=-1.0, descent=-1.0):
+    '''
+    evaluate with interpolators that are already built, for example those of a
+    ThrusterSettings instance
+    '''
+    if numpy is None:
+        return evaluate_points(interpolators, strength, power, j1_x, j1_y, j2_x, j2_y, ascent, descent)
+
+    # a response surface usually moves both joysticks over the same grid. In
+    # that case, the angle and length of each position are only calculated
+    # once
+    same_grid = j2_x is j1_x and j2_y is j1_y
+
+    # round each input at its own shape. They only grow to the full shape
+    # when they are combined
+    (j1_x, j1_y, j2_x, j2_y, ascent, descent) = [
+        numpy.round(numpy.asarray(value, dtype=float), PRECISION)
+        for value in (j1_x, j1_y, j2_x, j2_y, ascent, descent)
+    ]
+    shape = numpy.broadcast(j1_x, j1_y, j2_x, j2_y, ascent, descent).shape
+
+    j1 = polar(j1_x, j1_y)
+    j2 = j1 if same_grid else polar(j2_x, j2_y)
+
+    (left, right) = mix(j1, (interpolators[HL], interpolators[HR]), shape)
+    (back, front_left, front_right) = mix(j2, (interpolators[VC], interpolators[VL], interpolators[VR]), shape)
+
+    # apply vertical thrust without leaving the [-1,1] interval. Ascent takes
+    # priority over descent. Without triggers, there is nothing to do
+    ascending = ascent != -1.0
+    descending = ~ascending & (descent != -1.0)
+
+    if ascending.any() or descending.any():
+        highest = numpy.maximum(numpy.maximum(back, front_left), front_right)
+        lowest = numpy.minimum(numpy.minimum(back, front_left), front_right)
+        up = (1.0 - highest) * ((1.0 + ascent) / 2.0)
+        down = (lowest - -1.0) * ((1.0 + descent) / 2.0)
+        adjust = numpy.where(ascending, up, numpy.where(descending, -down, 0.0))
+
+        front_left = front_left + adjust
+        front_right = front_right + adjust
+
+    values = numpy.empty((THRUSTER_COUNT,) + shape)
+    values[HL] = left
+    values[VL] = front_left
+    values[VC] = back
+    values[VR] = front_right
+    values[HR] = right
+
+    sensitive = raise_to(values, power)
+    sensitive *= strength
+    sensitive += (1.0 - strength) * values
+    ticks = map_range(sensitive, -1.0, 1.0, FULL_REVERSE, FULL_FORWARD).astype(int)
+
+    return values, numpy.clip(ticks, 0, 4095, out=ticks)
+
+
+def raise_to(values, power):
+    '''
+    Raise every value to a power. The sensitivity power is normally a small
+    odd integer, and repeated multiplication is an order of magnitude faster
+    than a general pow for those. The results can differ from pow in the last
+    bit, which is far too small to change a PWM tick.
+    '''
+    if power.is_integer() and 1 <= power <= 9:
+        result = values.copy()
+
+        for i in range(int(power) - 1):
+            result *= values
+
+        return result
+    else:
+        return values**power
+
+
+def polar(x, y):
+    '''
+    Return the angle in degrees and the length, clamped to 1, of joystick
+    positions, the same way a MixingTable calculates them
+    '''
+    # work on flat arrays, so a single position is handled like a grid
+    (x, y) = numpy.broadcast_arrays(x, y)
+    shape = x.shape
+    (x, y) = (x.ravel(), y.ravel())
+
+    angle = numpy.arctan2(-y, x)
+    angle *= 180.0 / math.pi
+    angle[angle < 0.0] += 360.0
+
+    length = numpy.sqrt(x * x + y * y)
+    numpy.minimum(length, 1.0, out=length)
+
+    return angle.reshape(shape), length.reshape(shape)
+
+
+def mix(position, interpolators, shape):
+    '''
+    Vectorized version of looking up joystick positions, given by polar, in a
+    MixingTable
+    '''
+    (angle, length) = position
+    results = []
+
+    for interpolator in interpolators:
+        values = curve_values(interpolator, angle)
+        values *= length
+        results.append(numpy.broadcast_to(values, shape))
+
+    return results
+
+
+def curve_values(interpolator, angle):
+    '''
+    Evaluate a thruster curve that covers 0 to 360 degrees, like the curves a
+    MixingTable accepts, at an array of angles. This uses the same arithmetic
+    as Interpolator.valueAtIndex, but skips the range checks that
+    Interpolator.valuesAtIndices needs for curves with gaps.
+    '''
+    if not interpolator.compiled:
+        interpolator.compile()
+
+    indices = numpy.asarray(interpolator.indices, dtype=float)
+    shape = angle.shape
+    angle = angle.ravel()
+
+    # the last of any duplicate points starts the next segment
+    positions = numpy.searchsorted(indices, angle, side='right')
+    positions -= 1
+    numpy.clip(positions, 0, len(indices) - 1, out=positions)
+
+    start_indices = indices[positions]
+    result = angle - start_indices
+    result /= numpy.asarray(interpolator.index_deltas, dtype=float)[positions]
+    result *= numpy.asarray(interpolator.value_deltas, dtype=float)[positions]
+    result += numpy.asarray(interpolator.values, dtype=float)[positions]
+
+    # on an exact match with duplicate points, the first one wins
+    if len(set(interpolator.indices)) != len(indices):
+        first = numpy.searchsorted(indices, angle, side='left')
+        exact = (start_indices == angle) & (first != positions)
+        result[exact] = numpy.asarray(interpolator.values, dtype=float)[first[exact]]
+
+    return result.reshape(shape)
+
+
+def evaluate_points(interpolators, strength, power, j1_x, j1_y, j2_x, j2_y, ascent, descent):
+    columns = [
+        value if isinstance(value, (list, tuple)) else None
+        for value in (j1_x, j1_y, j2_x, j2_y, ascent, descent)
+    ]
+    count = max([len(column) for column in columns if column is not None] or [1])
+    inputs = [
+        column if column is not None else [value] * count
+        for (column, value) in zip(columns, (j1_x, j1_y, j2_x, j2_y, ascent, descent))
+    ]
+
+    values = [[] for i in range(THRUSTER_COUNT)]
+    ticks = [[] for i in range(THRUSTER_COUNT)]
+
+    for point in zip(*inputs):
+        point_values = evaluate_point(interpolators, *[round(value, PRECISION) for value in point])
+
+        for motor in range(THRUSTER_COUNT):
+            value = point_values[motor]
+            sensitive = strength * value**power + (1.0 - strength) * value
+            tick = int(map_range(sensitive, -1.0, 1.0, FULL_REVERSE, FULL_FORWARD))
+            values[motor].append(value)
+            ticks[motor].append(max(0, min(tick, 4095)))
+
+    return values, ticks
+
+
+def evaluate_point(interpolators, j1_x, j1_y, j2_x, j2_y, ascent, descent):
+    j1 = Vector2D(j1_x, j1_y)
+    j2 = Vector2D(j2_x, j2_y)
+    values = [0.0] * THRUSTER_COUNT
+
+    power = min(1.0, j1.length)
+    values[HL] = interpolators[HL].valueAtIndex(j1.angle) * power
+    values[HR] = interpolators[HR].valueAtIndex(j1.angle) * power
+
+    power = min(1.0, j2.length)
+    back = interpolators[VC].valueAtIndex(j2.angle) * power
+    front_left = interpolators[VL].valueAtIndex(j2.angle) * power
+    front_right = interpolators[VR].valueAtIndex(j2.angle) * power
+
+    if ascent != -1.0:
+        adjust = (1.0 - max(back, front_left, front_right)) * ((1.0 + ascent) / 2.0)
+    elif descent != -1.0:
+        adjust = -(min(back, front_left, front_right) - -1.0) * ((1.0 + descent) / 2.0)
+    else:
+        adjust = 0.0
+
+    values[VC] = back
+    values[VL] = front_left + adjust
+    values[VR] = front_right + adjust
+
+    return values
+
+
+if __name__ == "__main__":
+    pass
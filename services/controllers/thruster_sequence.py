@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+import sys
+import time
+from input_types import AUTOMATION
+from sequence import load_sequence, timeline, dry_run
+
+
+HOST = "192.168.0.212"
+PORT = 9999
+PIPELINE = True
+VERBOSE = False
+
+# the sequence file to run
+SEQUENCE = "sequences/thruster-test.json"
+
+# the number of times per second we update the thrusters while running the
+# sequence. When None, the sequence's own rate is used
+RATE = None
+
+# when set, the sequence runs against a simulated thruster controller on
+# this machine instead of being sent to the server
+DRY_RUN = False
+
+# where the dry run writes the PWM ticks of every control tick, if anywhere
+OUTPUT = None
+
+# the server lets a pilot take over from automation at any time
+controller = AUTOMATION
+
+# process command line args
+for i in range(1, len(sys.argv)):
+    arg = sys.argv[i]
+
+    if arg == "-h" or arg == "--host":
+        HOST = sys.argv[i + 1]
+    elif arg == "-n" or arg == "--no-pipeline":
+        PIPELINE = False
+    elif arg == "-r" or arg == "--rate":
+        RATE = float(sys.argv[i + 1])
+    elif arg == "-s" or arg == "--sequence":
+        SEQUENCE = sys.argv[i + 1]
+    elif arg == "-d" or arg == "--dry-run":
+        DRY_RUN = True
+    elif arg == "-o" or arg == "--output":
+        OUTPUT = sys.argv[i + 1]
+    elif arg == "-v" or arg == "--verbose":
+        VERBOSE = True
+
+# compile the whole sequence up front so nothing is computed while it plays
+start = time.perf_counter()
+
+try:
+    frames = timeline(load_sequence(SEQUENCE), RATE)
+except ValueError as e:
+    sys.exit("{}: {}".format(SEQUENCE, e))
+
+compile_time = time.perf_counter() - start
+
+duration = frames[-1][0] if frames else 0.0
+message_count = sum(len(changes) for (t, changes) in frames)
+
+print("{}: {:.2f} s, {} frames, {} messages, compiled in {:.1f} ms".format(
+    SEQUENCE, duration, len(frames), message_count, 1000 * compile_time
+))
+
+if DRY_RUN:
+    start = time.perf_counter()
+    results = dry_run(frames)
+    run_time = time.perf_counter() - start
+
+    print("Dry run: {} control ticks in {:.1f} ms".format(len(results), 1000 * run_time))
+
+    # the range of PWM ticks each thruster and the light saw
+    for (channel, name) in enumerate(("HL", "VL", "VC", "VR", "HR", "LIGHT")):
+        ticks = [t[1][channel] for t in results]
+        print("{:>5}: min {}, max {}, final {}".format(name, min(ticks), max(ticks), ticks[-1]))
+
+    if OUTPUT is not None:
+        with open(OUTPUT, 'w') as f:
+            f.write("time,HL,VL,VC,VR,HR,LIGHT\n")
+
+            for (t, ticks) in results:
+                f.write("{:.4f},{}\n".format(t, ",".join(str(tick) for tick in ticks)))
+else:
+    from thruster_connection import ThrusterConnection
+    from automation import Player
+
+    connection = ThrusterConnection(HOST, PORT, PIPELINE)
+    print("Connected to server")
+
+    player = Player(connection, controller, VERBOSE)
+    player.play(frames)
+    print(player.report())
+
+    connection.close()
@@ -1,15 +1,18 @@
 #!/usr/bin/env python3
 
+import os
 import sys
+import time
 import asyncio
-import websockets
 import socket
-import atexit
-import _thread
-import time
-from input_types import MOTOR, AXIS, BUTTON
-from message_3 import Message
+from input_types import MOTOR, AXIS, BUTTON, CONTROL
+from message_3 import Message, MessageDecoder, PIPELINE, ACK, SEQUENCE_MODULUS
 from thruster_controller import ThrusterController
+from input_coalescer import InputCoalescer
+from input_arbiter import InputArbiter
+from calibration_server import start_calibration_server
+from telemetry_log import TelemetryLog, log_filename
+from axis_filter import load_filter
 
 
 # Set default values before processing command line arguments
@@ -26,7 +29,23 @@ CONTROLLER_PORT = 9999
 CALIBRATION_PORT = 9998
 WEBSOCKETS_PORT = 9997
 
-turn_off = 0
+# The number of times per second we apply incoming messages to the thrusters.
+# Messages that arrive between control ticks are coalesced so that only the
+# latest value of each axis is applied. A rate of 0 applies every message as
+# soon as it arrives.
+CONTROL_RATE = 100
+
+# When set, every message we apply and the resulting PWM ticks are recorded
+# in a telemetry log in this directory
+LOG_DIRECTORY = None
+
+# When set, axis values are run through the same noise filter the client uses
+# before they are applied. This is useful for clients that don't filter. Only
+# one side should apply the dead zone, so when clients that filter connect as
+# well, use PREFILTERED instead. The server then only holds back changes
+# smaller than min_delta, which keeps the full range
+FILTER = False
+PREFILTERED = False
 
 # process command line args
 for i in range(1, len(sys.argv)):
@@ -40,54 +59,44 @@ for i in range(1, len(sys.argv)):
         VERBOSE = True
     elif arg == "-w" or arg == "--websockets":
         WEBSOCKETS = True
+    elif arg == "-r" or arg == "--rate":
+        CONTROL_RATE = float(sys.argv[i + 1])
+    elif arg == "-l" or arg == "--log":
+        LOG_DIRECTORY = sys.argv[i + 1]
+    elif arg == "-f" or arg == "--filter":
+        FILTER = True
+    elif arg == "-p" or arg == "--prefiltered":
+        FILTER = True
+        PREFILTERED = True
     # TODO: add command-line args for setting host and ports
 
-# create thruster controller globally so we can share it between threads
+# create thruster controller globally. Every client, the control loop and the
+# calibration API run on a single asyncio event loop, so all updates to the
+# controller are serialized without any locking
 controller = ThrusterController(SIMULATE)
 
+# messages from all clients are collected here until the next control tick
+coalescer = InputCoalescer()
 
-def on_calibration_server(controller):
-    import os
-    from bottle import put, request, route, run, static_file
-
-    script_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), "calibration")
-    css_dir = os.path.join(script_dir, "css")
-    js_dir = os.path.join(script_dir, "js")
-    settings_dir = os.path.join(script_dir, "..", "settings")
-
-    @route('/')
-    def index():
-        return static_file('index.html', root=script_dir)
-
-    @route('/css/<filename>')
-    def serve_css(filename):
-        return static_file(filename, root=css_dir)
+# when several clients are connected, this decides whose input drives the
+# thrusters
+arbiter = InputArbiter()
 
-    @route('/js/<filename>')
-    def server_js(filename):
-        return static_file(filename, root=js_dir)
+axis_filter = load_filter(prefiltered=PREFILTERED) if FILTER else None
 
-    @route('/api/settings')
-    def api_settings():
-        return controller.get_settings()
+telemetry = None
 
-    @route('/api/settings/<name>')
-    def api_settings_file(name):
-        return static_file(name + ".json", root=settings_dir)
-
-    @put('/api/settings')
-    def put_settings():
-        controller.set_settings(request.json)
-        return {'status': 'OK'}
-
-    print("Calibration web server bound to {}:{}".format(HOST, CONTROLLER_PORT))
-
-    run(host=HOST, port=CALIBRATION_PORT)
+if LOG_DIRECTORY is not None:
+    try:
+        os.makedirs(LOG_DIRECTORY, exist_ok=True)
+        telemetry = TelemetryLog(log_filename(LOG_DIRECTORY))
+    except OSError as e:
+        sys.exit("Unable to create a telemetry log in {}: {}".format(LOG_DIRECTORY, e))
 
+    print("Logging telemetry to", telemetry.path)
 
-def process_message(msg):
-    m = Message(msg)
 
+def process_message(m):
     if m.input_type == MOTOR:
         if VERBOSE:
             print("Setting motor {} to {}".format(m.input_index, m.input_value))
@@ -102,115 +111,314 @@ def process_message(msg):
         controller.update_axis(m.input_index, m.input_value)
 
 
-async def websocket_loop(websocket, path):
-    while True:
-        msg = await websocket.recv()
+def record_telemetry(messages):
+    '''
+    Record messages that were just applied along with the PWM ticks they
+    resulted in. Messages are recorded as they arrived, before the axis
+    filter changed them, along with the value that was applied. This only copies a few bytes into the memory mapped log, so
+    it is cheap enough to do for every message. When there are no messages,
+    the ticks are still recorded if they changed, for example because the
+    slew limiter stepped or the motors were turned off.
+    '''
+    if telemetry is not None:
+        ticks = [device.off for device in controller.motor_controller.devices]
 
-        if len(msg) == 0:
-            controller.turn_off_motors()
-            print("disconnecting client\n   shutting down thrusters...")
-            break
-        else: 
-            process_message(msg)
+        for m in messages:
+            if m.raw_value is None:
+                telemetry.record(m.header, m.input_value, ticks)
+            else:
+                telemetry.record(m.header, m.raw_value, ticks, m.input_value)
 
-        await websocket.send("OK")
+        if not messages:
+            telemetry.record_ticks(ticks)
 
 
-def on_websocket_server(controller, event_loop):
-    start_server = websockets.serve(websocket_loop, "", WEBSOCKETS_PORT)
+def submit_message(m):
+    '''
+    Hand a message received from a client to the thrusters, either right away
+    or on the next control tick when coalescing
+    '''
+    if axis_filter is not None and m.input_type == AXIS:
+        value = axis_filter.filter(m.controller_index, m.input_index, m.input_value)
+
+        if value is None:
+            return
+
+        # keep the value as it arrived for the telemetry log
+        m.raw_value = m.input_value
+        m.input_value = value
 
-    print("Thruster websocket server bound to {}:{}".format(HOST, WEBSOCKETS_PORT))
+    deliver_message(m)
 
-    event_loop.run_until_complete(start_server)
-    event_loop.run_forever()
 
+def deliver_message(m):
+    if CONTROL_RATE > 0:
+        coalescer.put(m)
+    else:
+        apply_messages([m], time.monotonic())
 
-def on_new_client(controller, clientsocket, addr):
+
+def submit_settled():
     '''
-    This function is responsible for communicating with an active socket
-    connection. All input is passed directly to the thruster controller making
-    this very lightweight. If we get an empty message from the client, this
-    indicates that the conection needs to be shutdown
+    Hand over the axis values the filter held back once their axes have
+    stopped moving
+    '''
+    if axis_filter is not None:
+        for (controller_index, axis, value) in axis_filter.settled():
+            m = Message.create(controller_index, AXIS, axis, value)
+            m.raw_value = axis_filter.inputs[(controller_index, axis)]
+            deliver_message(m)
 
-    NOTE: The functionality in here is bare bones. It would be wise to
-    introduce a handshake upon initial connection with the client. This
-    handshake should confirm that the version of this server and the version of
-    the client are compatible. This implies that our responses need to grow in
-    complexity.
+
+def apply_messages(messages, now, step=None):
+    '''
+    Apply the messages that won arbitration, then record the result. When
+    step is given, slew limited thrusters are moved towards their targets by
+    that many seconds in the same batch.
     '''
-    global turn_off
+    (reset_requested, messages) = arbiter.arbitrate(messages, now)
 
-    while True:
+    if reset_requested:
+        controller.turn_off_motors()
 
-        msg = clientsocket.recv(1024)
+    with controller.batch():
+        for m in messages:
+            process_message(m)
 
-        if (turn_off):
-            controller.turn_off_motors()
-            exit(0)
-        elif msg == b'':
-            controller.turn_off_motors()
-            print("disconnecting client\n   shutting down thrusters...")
-            break
-        else:
-            process_message(msg)
+        if step is not None:
+            controller.step(step)
+
+    # the ticks are recorded after the step, so they are what the thrusters
+    # are actually running at
+    record_telemetry(messages)
+
+    return messages
+
+
+def release_controllers(controllers):
+    '''
+    Forget the controllers a client was using once it disconnects. If one of
+    them was driving the thrusters, the thrusters are turned off and any other
+    connected controller can take over.
+    '''
+    for controller_index in controllers:
+        coalescer.discard(controller_index)
+        arbiter.release(controller_index)
+
+        if axis_filter is not None:
+            axis_filter.release(controller_index)
+
+    if CONTROL_RATE == 0:
+        apply_messages([], time.monotonic())
+
+
+async def control_loop(controller, coalescer):
+    '''
+    Apply the coalesced messages to the thrusters at a fixed rate. We schedule
+    each tick against an absolute deadline so the rate does not drift with the
+    time it takes to process the messages. If we fall behind, we skip ahead
+    rather than trying to catch up with a burst of ticks.
+    '''
+    loop = asyncio.get_event_loop()
+    period = 1.0 / CONTROL_RATE
+    deadline = loop.time()
+    last_tick = deadline
 
-        # this is a simple confirmation to the client that we have received its
-        # message and have processed it correctly. Ideally, this would be more
-        # formalized allowing for error responses and such.
-        clientsocket.send("OK".encode())
+    # we step the thrusters towards their targets on every tick, so they can
+    # be slew limited
+    controller.use_limiter = True
 
-    clientsocket.close()
+    while True:
+        deadline += period
+        delay = deadline - loop.time()
+
+        if delay > 0:
+            await asyncio.sleep(delay)
+        else:
+            deadline = loop.time()
+            await asyncio.sleep(0)
+
+        now = loop.time()
+        submit_settled()
+        apply_messages(coalescer.take(), now, now - last_tick)
+        last_tick = now
 
 
-def close_socket():
+async def settle_loop():
     '''
-    This function is called when the script shuts down. We need to make sure
-    that we cleanly close all sockets we opened in this script. Simply close
-    the socket to free any system level resources we are using.
+    Without a control loop, check for settled axis values on our own
     '''
-    s.close()
+    while True:
+        await asyncio.sleep(axis_filter.settle_time / 2)
+        submit_settled()
 
 
-# Start calibration server
-if CALIBRATE:
-    _thread.start_new_thread(on_calibration_server, (controller,))
+async def websocket_loop(websocket, path=None):
+    from websockets.exceptions import ConnectionClosed
 
-# Start websocket server
-if WEBSOCKETS:
-    _thread.start_new_thread(on_websocket_server, (controller, asyncio.get_event_loop()))
+    decoder = MessageDecoder()
+    controllers = set()
 
-# Start listening on a socket
-if SOCKETS:
+    try:
+        while True:
+            msg = await websocket.recv()
+
+            # messages are binary. A text frame can't hold one, so don't let
+            # the decoder try
+            if isinstance(msg, str):
+                await websocket.send("ERROR: binary messages only")
+                continue
+
+            if len(msg) == 0:
+                release_controllers(controllers)
+                print("disconnecting client\n   releasing its controllers...")
+                break
+            else:
+                for m in decoder.feed(msg):
+                    controllers.add(m.controller_index)
+                    submit_message(m)
+
+            await websocket.send("OK")
+    except ConnectionClosed:
+        # browsers close the websocket rather than sending an empty message
+        release_controllers(controllers)
+        print("lost websocket client\n   releasing its controllers...")
+
+
+async def on_new_client(reader, writer):
+    '''
+    This function is responsible for communicating with an active socket
+    connection. All input is passed directly to the thruster controller making
+    this very lightweight. If we get an empty message from the client, this
+    indicates that the conection needs to be shutdown
 
-    # Create a socket to listen for incoming connections
-    s = socket.socket()
+    By default, we respond to every chunk of messages with "OK". A client can
+    send a PIPELINE control message to switch the connection to pipelined
+    mode. In that mode, we respond to every chunk of messages with a single
+    cumulative ACK that holds the number of messages processed so far. This
+    lets the client stream messages without waiting for each one.
+    '''
+    addr = writer.get_extra_info('peername')
 
-    # make sure to close our socket when the script exits
-    atexit.register(close_socket)
+    # show some feedback on who connected
+    print('Got connection from', addr)
 
-    # listen for connections on the specified IP address and port
-    s.bind((HOST, CONTROLLER_PORT))
+    # a single read may contain several messages, or only part of one, so we
+    # let the decoder reassemble complete messages for us
+    decoder = MessageDecoder()
+    pipelined = False
+    processed = 0
 
-    # Begin listening for incoming connections allowing up to 5 unconnected
-    # requests to queue up before we start refusing connections
-    s.listen(5)
+    # the controllers this client has sent input for
+    controllers = set()
 
-    print("Thruster server bound to {}:{}".format(HOST, CONTROLLER_PORT))
+    # acks are tiny and latency sensitive, so don't let Nagle hold them back
+    clientsocket = writer.get_extra_info('socket')
+    clientsocket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
 
     try:
         while True:
-            # wait for an incoming connection
-            c, addr = s.accept()
-
-            # show some feedback on who connected
-            print('Got connection from', addr)
-
-            # start a new thread to handle the connection. This prevents this thread
-            # from hanging so it can process any other new connections that might
-            # come in
-            _thread.start_new_thread(on_new_client, (controller, c, addr))
-    except KeyboardInterrupt:
-        print ("Ctl-C Interupt - Shutting Down Thrusters...")
-        turn_off = 1
-        time.sleep(1)
-        print ("Thrusters Shut Down - Exiting...")
+            msg = await reader.read(1024)
+
+            if msg == b'':
+                release_controllers(controllers)
+                print("disconnecting client\n   releasing its controllers...")
+                break
+
+            received = 0
+
+            for m in decoder.feed(msg):
+                if m.input_type == CONTROL:
+                    if m.input_index == PIPELINE:
+                        if VERBOSE:
+                            print("Pipelining messages from", addr)
+                        pipelined = True
+                else:
+                    controllers.add(m.controller_index)
+                    submit_message(m)
+                    processed = (processed + 1) % SEQUENCE_MODULUS
+                received += 1
+
+            # wait for the rest of a partial message before responding
+            if received == 0:
+                continue
+
+            if pipelined:
+                ack = Message.create(0, CONTROL, ACK, float(processed))
+                writer.write(bytes(ack))
+            else:
+                # this is a simple confirmation to the client that we have
+                # received its message and have processed it correctly.
+                # Ideally, this would be more formalized allowing for error
+                # responses and such.
+                writer.write("OK".encode())
+
+            await writer.drain()
+    except ConnectionError:
+        release_controllers(controllers)
+        print("lost client connection\n   releasing its controllers...")
+    finally:
+        writer.close()
+
+
+async def start_servers(loop):
+    servers = []
+
+    # Start applying coalesced messages to the thrusters
+    if CONTROL_RATE > 0:
+        loop.create_task(control_loop(controller, coalescer))
+    elif axis_filter is not None:
+        loop.create_task(settle_loop())
+
+    # Start calibration server
+    if CALIBRATE:
+        servers.append(await start_calibration_server(controller, HOST, CALIBRATION_PORT))
+        print("Calibration web server bound to {}:{}".format(HOST, CALIBRATION_PORT))
+
+    # Start websocket server
+    if WEBSOCKETS:
+        import websockets
+
+        servers.append(await websockets.serve(websocket_loop, HOST, WEBSOCKETS_PORT))
+        print("Thruster websocket server bound to {}:{}".format(HOST, WEBSOCKETS_PORT))
+
+    # Start listening on a socket. We allow up to 5 unconnected requests to
+    # queue up before we start refusing connections
+    if SOCKETS:
+        servers.append(await asyncio.start_server(on_new_client, HOST, CONTROLLER_PORT, backlog=5))
+        print("Thruster server bound to {}:{}".format(HOST, CONTROLLER_PORT))
+
+    return servers
+
+
+loop = asyncio.new_event_loop()
+asyncio.set_event_loop(loop)
+servers = loop.run_until_complete(start_servers(loop))
+
+try:
+    loop.run_forever()
+except KeyboardInterrupt:
+    print ("Ctl-C Interupt - Shutting Down Thrusters...")
+    controller.turn_off_motors()
+
+    # make sure that we cleanly close all sockets we opened in this script to
+    # free any system level resources we are using
+    for server in servers:
+        server.close()
+
+    # finish saving any settings changes that are still pending
+    controller.settings_writer.close()
+
+    if telemetry is not None:
+        telemetry.close()
+
+    if axis_filter is not None:
+        print("Axis values applied: {}, filtered out: {}".format(axis_filter.passed, axis_filter.suppressed))
+
+    # show how busy the I2C bus was during this run
+    if controller.motor_controller is not None:
+        print("PWM bus writes: {writes}, channels written: {channels_written}, suppressed: {suppressed}, bus time: {bus_time:.3f}s".format(
+            **controller.motor_controller.counters()
+        ))
+
+    print ("Thrusters Shut Down - Exiting...")
@@ -1,19 +1,120 @@
 #!/usr/bin/env python3
 
+import atexit
+import struct
+import sys
+import time
+from array import array
 from sense_hat import SenseHat
 from pymongo import MongoClient
+from bson.binary import Binary
 from datetime import datetime
+from mongo_writer import MongoWriter
+
+
+# Samples are written to the database in the background. While the database
+# can't be reached, they are kept in this file and written once it's back.
+SPOOL_FILE = "imu-logger.spool"
+
+# In full rate mode, we keep every sample instead of only the last one each
+# second. Samples are grouped into one document per BLOCK_SECONDS window.
+FULL_RATE = False
+BLOCK_SECONDS = 10.0
+
+# process command line args
+for i in range(1, len(sys.argv)):
+    arg = sys.argv[i]
+
+    if arg == "-f" or arg == "--full-rate":
+        FULL_RATE = True
+
+
+class SampleBlock:
+    '''
+    Every sample taken during one window of time. Rather than storing one
+    document per sample, each value is kept in a compact array. When the block
+    is written, each array is stored as little endian binary data, whatever
+    machine we run on: float64 ("<f8") for the sample times and float32
+    ("<f4") for everything else. The document names these formats, so a
+    reader can load the arrays with numpy.frombuffer.
+
+    Sample times are taken from a monotonic clock and are stored as seconds
+    since the start of the block. The wall clock time of the start of the
+    block is stored with it.
+    '''
+
+    FIELDS = (
+        "pitch", "roll", "yaw",
+        "gyroscope_x", "gyroscope_y", "gyroscope_z",
+        "accelerometer_x", "accelerometer_y", "accelerometer_z"
+    )
+
+    def __init__(self, start_time, start_monotonic):
+        self.start_time = start_time
+        self.start_monotonic = start_monotonic
+        self.times = array('d')
+        self.values = {field: array('f') for field in self.FIELDS}
+
+    def __len__(self):
+        return len(self.times)
+
+    def add(self, monotonic, orientation, gyroscope, acceleration):
+        values = self.values
+
+        self.times.append(monotonic - self.start_monotonic)
+        values["pitch"].append(orientation["pitch"])
+        values["roll"].append(orientation["roll"])
+        values["yaw"].append(orientation["yaw"])
+        values["gyroscope_x"].append(gyroscope["x"])
+        values["gyroscope_y"].append(gyroscope["y"])
+        values["gyroscope_z"].append(gyroscope["z"])
+        values["accelerometer_x"].append(acceleration["x"])
+        values["accelerometer_y"].append(acceleration["y"])
+        values["accelerometer_z"].append(acceleration["z"])
+
+    def to_document(self):
+        count = len(self.times)
+        document = {
+            "start": self.start_time,
+            "count": count,
+            "formats": {"times": "<f8", "values": "<f4"},
+            "times": Binary(struct.pack("<{}d".format(count), *self.times))
+        }
+
+        values = struct.Struct("<{}f".format(count))
+
+        for field in self.FIELDS:
+            document[field] = Binary(values.pack(*self.values[field]))
+
+        return document
 
 
 sense = SenseHat()
-client = MongoClient("mongodb://10.0.1.25:27017")
+# fail fast when the database is down so the writer can start spooling
+client = MongoClient("mongodb://10.0.1.25:27017", serverSelectionTimeoutMS=2000)
 db = client.g2x
+writer = MongoWriter(db, SPOOL_FILE)
+
+# write out anything still queued when the script exits
+atexit.register(writer.close)
+
+
+def write_last_block():
+    if block is not None and len(block) > 0:
+        writer.put("imu_blocks", block.to_document())
+
+
+# atexit runs handlers in reverse order, so the last block is queued before the
+# writer is closed
+atexit.register(write_last_block)
 
 last_time = datetime.utcnow()
 sample_count = 0
+block = None
 
 while True:
     current_time = datetime.utcnow()
+    current_monotonic = time.monotonic()
     elapsed_time = current_time - last_time
 
     orientation = sense.get_orientation()
@@ -25,6 +126,16 @@ while True:
 
     sample_count += 1
 
+    if FULL_RATE:
+        if block is not None and current_monotonic - block.start_monotonic >= BLOCK_SECONDS:
+            writer.put("imu_blocks", block.to_document())
+            block = None
+
+        if block is None:
+            block = SampleBlock(current_time, current_monotonic)
+
+        block.add(current_monotonic, orientation, gyroscope, acceleration)
+
     if elapsed_time.seconds >= 1:
         print("samples per second =", sample_count)
         print("orientation =", orientation)
@@ -33,29 +144,30 @@ while True:
         print("compass =", compass)
         print("temperature_from_humidity =", temperature_from_humidity)
         print("temperature_from_pressure =", temperature_from_pressure)
+        print("written = {}, spooled = {}, dropped = {}, rejected = {}".format(writer.written, writer.spooled, writer.dropped, writer.rejected))
 
         last_time = current_time
         sample_count = 0
 
-        db.orientation.insert_one({
+        writer.put("orientation", {
             "pitch": orientation["pitch"],
             "roll": orientation["roll"],
             "yaw": orientation["yaw"]
         })
-        db.gyroscope.insert_one({
+        writer.put("gyroscope", {
             "x": gyroscope["x"],
             "y": gyroscope["y"],
             "z": gyroscope["z"]
         })
-        db.accelerometer.insert_one({
+        writer.put("accelerometer", {
             "x": acceleration["x"],
             "y": acceleration["y"],
             "z": acceleration["z"]
         })
-        db.compass.insert_one({
+        writer.put("compass", {
             "angle": compass
         })
-        db.temperature.insert_one({
+        writer.put("temperature", {
             "from_humidity": temperature_from_humidity,
             "from_pressure": temperature_from_pressure
         })
@@ -0,0 +1,235 @@
+import os
+import queue
+import threading
+import time
+import traceback
+from bson import ObjectId, json_util
+from pymongo.errors import BulkWriteError, PyMongoError
+
+
+# Mongo's error code for inserting a document whose _id already exists
+DUPLICATE_KEY = 11000
+
+
+class MongoWriter:
+    '''
+    Writes documents to MongoDB from a background thread so that a sampling
+    loop never waits on the database.
+
+    Documents are placed on a bounded queue and written with insert_many once
+    max_batch documents have been collected or max_delay seconds have passed.
+    If the database can not be reached, batches are appended to a spool file on
+    local disk and replayed once the database is available again.
+
+    Every document is given its _id when it is queued. That way the ObjectId
+    still reflects when the sample was taken, and replaying a batch that was
+    partially written before can not create duplicates.
+
+    Documents the database rejects for any other reason would be rejected
+    again on every retry, so they are appended to a separate rejected file
+    instead of being spooled.
+    '''
+
+    def __init__(self, db, spool_path, max_batch=500, max_delay=1.0, queue_size=10000, retry_interval=10.0):
+        self.db = db
+        self.spool_path = spool_path
+        self.replay_path = spool_path + ".replay"
+        self.rejected_path = spool_path + ".rejected"
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.retry_interval = retry_interval
+        self.queue = queue.Queue(queue_size)
+
+        # when the database is down, don't try to reach it again until this time
+        self.next_attempt = 0.0
+
+        # counters to show how the writer is keeping up
+        self.written = 0
+        self.spooled = 0
+        self.dropped = 0
+        self.rejected = 0
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def put(self, collection, document):
+        '''
+        Queue a document to be inserted into the named collection. This never
+        blocks. If the queue is full, the document is dropped and counted.
+        '''
+        document["_id"] = ObjectId()
+
+        try:
+            self.queue.put_nowait((collection, document))
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self, timeout=5.0):
+        self.queue.put(None)
+        self.thread.join(timeout)
+
+    def run(self):
+        batch = []
+        deadline = None
+
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = False
+
+            if item is None:
+                self.flush(batch)
+                return
+            elif item is not False:
+                if deadline is None:
+                    deadline = time.monotonic() + self.max_delay
+                batch.append(item)
+
+            if len(batch) >= self.max_batch or (deadline is not None and time.monotonic() >= deadline):
+                self.flush(batch)
+                batch = []
+                deadline = None
+
+    def flush(self, batch):
+        '''
+        Write a batch, then replay anything spooled if the database is
+        reachable. This runs on the writer thread, so an unexpected error,
+        such as being unable to write the spool file, is reported instead of
+        stopping the thread while put keeps queueing.
+        '''
+        try:
+            if self.write(batch):
+                self.replay()
+        except Exception:
+            print("unable to flush documents:")
+            traceback.print_exc()
+
+    def write(self, batch):
+        '''
+        Insert a batch into the database, or spool it to disk if the database
+        is unavailable. Returns True if the database was reachable, so the
+        batch does not need to be written again.
+
+        A batch that fails with anything other than a database error, for
+        example a document that can't be encoded, would fail the same way on
+        every retry, so it is reported and dropped.
+        '''
+        if len(batch) == 0:
+            return True
+
+        if time.monotonic() >= self.next_attempt:
+            try:
+                if self.insert(batch):
+                    return True
+            except Exception:
+                print("unable to write batch of {} documents:".format(len(batch)))
+                traceback.print_exc()
+                self.dropped += len(batch)
+                return True
+
+        self.spool(batch)
+
+        return False
+
+    def insert(self, batch):
+        '''
+        Insert a batch, grouping the documents by collection. Returns False if
+        the database could not be reached.
+        '''
+        collections = {}
+
+        for (collection, document) in batch:
+            collections.setdefault(collection, []).append(document)
+
+        rejected = []
+
+        try:
+            for (collection, documents) in collections.items():
+                try:
+                    self.db[collection].insert_many(documents, ordered=False)
+                except BulkWriteError as e:
+                    # documents that were already written by an earlier attempt
+                    # are fine. Anything else was rejected by the database and
+                    # would be rejected again, so it is set aside
+                    for error in e.details.get("writeErrors", []):
+                        if error.get("code") != DUPLICATE_KEY:
+                            print("database rejected document:", error.get("errmsg"))
+                            rejected.append((collection, documents[error["index"]]))
+        except PyMongoError as e:
+            print("unable to write to database:", e)
+            self.next_attempt = time.monotonic() + self.retry_interval
+            return False
+
+        if rejected:
+            self.reject(rejected)
+
+        self.written += len(batch) - len(rejected)
+
+        return True
+
+    def spool(self, batch):
+        append_records(self.spool_path, batch)
+        self.spooled += len(batch)
+
+    def reject(self, batch):
+        append_records(self.rejected_path, batch)
+        self.rejected += len(batch)
+
+    def replay(self):
+        '''
+        Write spooled batches to the database. The spool file is moved out of
+        the way first so that anything that fails again is spooled to a new
+        file. If we stopped in the middle of a replay, for example because
+        the process was killed, the old replay file is finished first.
+        Documents it already wrote are skipped as duplicates.
+        '''
+        while True:
+            if not os.path.isfile(self.replay_path):
+                if not os.path.isfile(self.spool_path):
+                    return
+
+                os.replace(self.spool_path, self.replay_path)
+
+            print("replaying spooled documents")
+
+            batch = []
+            reached = True
+
+            with open(self.replay_path, "r") as f:
+                for line in f:
+                    try:
+                        record = json_util.loads(line)
+                    except ValueError:
+                        # the last line can be cut short if we were stopped
+                        # while spooling
+                        print("skipping unreadable spooled document")
+                        self.dropped += 1
+                        continue
+
+                    batch.append((record["collection"], record["document"]))
+
+                    if len(batch) >= self.max_batch:
+                        reached = self.write(batch) and reached
+                        batch = []
+
+            reached = self.write(batch) and reached
+            os.remove(self.replay_path)
+
+            # whatever failed is in a new spool file. Leave it for the next
+            # time the database is reachable
+            if not reached:
+                return
+
+
+def append_records(path, batch):
+    with open(path, "a") as out:
+        for (collection, document) in batch:
+            out.write(json_util.dumps({"collection": collection, "document": document}))
+            out.write("\n")
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,488 @@
+# for sentence formats, see http://www.gpsinformation.org/dale/nmea.htm
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from functools import reduce
+from operator import xor
+
+
+# Each record holds the values of one sentence. Positions are converted from
+# the NMEA ddmm.mmmm format to signed decimal degrees (negative for south and
+# west). Times (hhmmss.sss) and dates (ddmmyy) are kept as the strings in the
+# sentence. Empty fields become None.
+GGA = namedtuple("GGA", [
+    "talker", "time", "latitude", "longitude", "fix_quality", "satellite_count",
+    "hdop", "altitude", "geoid_height", "dgps_age", "dgps_station"
+])
+RMC = namedtuple("RMC", [
+    "talker", "time", "status", "latitude", "longitude", "speed_knots",
+    "track_angle", "date", "magnetic_variation", "mode"
+])
+GSA = namedtuple("GSA", [
+    "talker", "selection", "fix_type", "prns", "pdop", "hdop", "vdop"
+])
+VTG = namedtuple("VTG", [
+    "talker", "true_track", "magnetic_track", "speed_knots", "speed_kph", "mode"
+])
+GSV = namedtuple("GSV", [
+    "talker", "satellite_count", "satellites"
+])
+Satellite = namedtuple("Satellite", ["prn", "elevation", "azimuth", "snr"])
+
+# A sentence is at most 82 characters long. If this many bytes arrive without
+# a newline, the source is not sending NMEA and what we have is dropped.
+MAX_LINE_LENGTH = 1024
+
+
+def checksum(body):
+    '''
+    XOR all bytes of a sentence body together. A sentence body fits in 128
+    bytes, so we read it as one integer and XOR it with itself shifted by 1,
+    2, 4, ... 64 bytes. Each step folds twice as many bytes into every byte,
+    so the lowest byte ends up holding the XOR of all of them. Anything
+    longer is not a valid sentence, but gets the plain byte by byte version.
+    '''
+    if len(body) > 128:
+        return reduce(xor, body, 0)
+
+    value = int.from_bytes(body, "little")
+    value ^= value >> 8
+    value ^= value >> 16
+    value ^= value >> 32
+    value ^= value >> 64
+    value ^= value >> 128
+    value ^= value >> 256
+    value ^= value >> 512
+
+    return value & 0xFF
+
+
+def to_float(field):
+    return float(field) if field else None
+
+
+def to_int(field):
+    return int(field) if field else None
+
+
+def to_degrees(field, hemisphere):
+    '''
+    Convert a ddmm.mmmm or dddmm.mmmm position to signed decimal degrees
+    '''
+    if not field:
+        return None
+
+    value = float(field)
+    degrees = int(value / 100)
+    result = degrees + (value - degrees * 100) / 60.0
+
+    return -result if hemisphere == "S" or hemisphere == "W" else result
+
+
+def parse_gga(talker, fields):
+    '''
+    $GPGGA,003907.000,4741.0757,N,11647.1921,W,2,08,1.10,670.1,M,-16.9,M,0000,0000*56
+
+    GGA          Global Positioning System Fix Data
+    003907.000   Fix taken at 12:35:19 UTC
+    4741.0757,N  Latitude 48 deg 07.038' N
+    11647.1921,W Longitude 11 deg 31.000' E
+    2            Fix quality:   0 = invalid
+                                1 = GPS fix (SPS)
+                                2 = DGPS fix
+                                3 = PPS fix
+                                4 = Real Time Kinematic
+                                5 = Float RTK
+                                6 = estimated (dead reckoning) (2.3 feature)
+                                7 = Manual input mode
+                                8 = Simulation mode
+    08           Number of satellites being tracked
+    1.10         Horizontal dilution of position
+    670.1,M      Altitude, Meters, above mean sea level
+    -16.9,M      Height of geoid (mean sea level) above WGS84
+                 ellipsoid
+    0000         time in seconds since last DGPS update
+    0000         DGPS station ID number
+    *56          the checksum data, always begins with *
+    '''
+    return GGA(
+        talker,
+        fields[1],
+        to_degrees(fields[2], fields[3]),
+        to_degrees(fields[4], fields[5]),
+        to_int(fields[6]),
+        to_int(fields[7]),
+        to_float(fields[8]),
+        to_float(fields[9]),
+        to_float(fields[11]) if len(fields) > 11 else None,
+        to_float(fields[13]) if len(fields) > 13 else None,
+        (fields[14] or None) if len(fields) > 14 else None
+    )
+
+
+def parse_rmc(talker, fields):
+    '''
+    $GPRMC,003758.000,A,4741.0717,N,11647.1868,W,0.26,151.76,080517,,,D*7E
+
+    RMC          Recommended Minimum sentence C
+    003758.000   Fix taken at 12:35:19 UTC
+    A            Status A=active or V=Void.
+    4741.0717,N  Latitude 48 deg 07.038' N
+    11647.1868,W Longitude 11 deg 31.000' E
+    0.26         Speed over the ground in knots
+    151.76       Track angle in degrees True
+    080517       Date - 8th of May 2017
+    003.1,W      Magnetic Variation
+    D            ?
+    *7E          The checksum data, always begins with *
+    '''
+    variation = to_float(fields[10]) if len(fields) > 10 else None
+
+    if variation is not None and len(fields) > 11 and fields[11] == "W":
+        variation = -variation
+
+    return RMC(
+        talker,
+        fields[1],
+        fields[2],
+        to_degrees(fields[3], fields[4]),
+        to_degrees(fields[5], fields[6]),
+        to_float(fields[7]),
+        to_float(fields[8]),
+        fields[9],
+        variation,
+        (fields[12] or None) if len(fields) > 12 else None
+    )
+
+
+def parse_gsa(talker, fields):
+    '''
+    $GPGSA,A,3,19,24,17,02,29,12,05,25,06,,,,1.49,0.96,1.13*04
+
+    GSA      Satellite status
+    A        Auto selection of 2D or 3D fix (M = manual)
+    3        3D fix - values include:   1 = no fix
+                                        2 = 2D fix
+                                        3 = 3D fix
+    19,24... PRNs of satellites used for fix (space for 12)
+    1.49     PDOP (dilution of precision)
+    0.96     Horizontal dilution of precision (HDOP)
+    1.13     Vertical dilution of precision (VDOP)
+    *04      the checksum data, always begins with *
+    '''
+    return GSA(
+        talker,
+        fields[1],
+        to_int(fields[2]),
+        tuple(map(int, filter(None, fields[3:15]))),
+        to_float(fields[15]),
+        to_float(fields[16]),
+        to_float(fields[17])
+    )
+
+
+def parse_vtg(talker, fields):
+    '''
+    $GPVTG,305.74,T,,M,0.03,N,0.05,K,D*3B
+
+    VTG          Track made good and ground speed
+    305.74,T     True track made good (degrees)
+    ,M           Magnetic track made good
+    0.03,N       Ground speed, knots
+    0.05,K       Ground speed, Kilometers per hour
+    D            ?
+    *3B          Checksum
+    '''
+    return VTG(
+        talker,
+        to_float(fields[1]),
+        to_float(fields[3]),
+        to_float(fields[5]),
+        to_float(fields[7]),
+        (fields[9] or None) if len(fields) > 9 else None
+    )
+
+
+def parse_gsv_satellites(fields):
+    '''
+    $GPGSV,3,1,11,12,83,219,41,02,77,169,36,06,48,057,27,25,43,306,26*79
+    $GPGSV,3,2,11,48,33,201,35,19,24,079,24,24,21,216,27,29,15,271,30*7A
+    $GPGSV,3,3,11,05,13,158,33,17,07,084,23,31,06,333,18*40
+
+    GSV          Satellites in view
+    3            Number of sentences for full data
+    1            sentence 1 of 3
+    11           Number of satellites in view
+
+    12           Satellite PRN number
+    83           Elevation, degrees
+    219          Azimuth, degrees
+    41           SNR - higher is better
+                 for up to 4 satellites per sentence
+    *79          the checksum data, always begins with *
+    '''
+    # each satellite is a group of four fields. A partial group at the end is
+    # ignored
+    values = fields[4:4 + (len(fields) - 4) // 4 * 4]
+
+    # usually every field is filled in, so we can convert them all at once
+    # and hand out groups of four from a single iterator
+    if "" not in values:
+        values = iter(map(int, values))
+        return list(map(Satellite._make, zip(values, values, values, values)))
+
+    satellites = []
+
+    for i in range(0, len(values), 4):
+        (prn, elevation, azimuth, snr) = values[i:i + 4]
+
+        if prn:
+            satellites.append(Satellite(
+                int(prn),
+                int(elevation) if elevation else None,
+                int(azimuth) if azimuth else None,
+                int(snr) if snr else None
+            ))
+
+    return satellites
+
+
+class TimestampDecoder:
+    '''
+    Converts the hhmmss.sss time and ddmmyy date fields of a sentence into a
+    timezone aware datetime in the given timezone. Fractional seconds are
+    dropped.
+
+    The date rarely changes between sentences, so we keep UTC midnight of the
+    last date we saw and only add the time of day to it.
+    '''
+
+    def __init__(self, tz):
+        self.tz = tz
+        self.date = None
+        self.midnight = None
+
+    def decode(self, time, date):
+        if date != self.date:
+            self.midnight = datetime(
+                2000 + int(date[4:6]),
+                int(date[2:4]),
+                int(date[0:2]),
+                tzinfo=timezone.utc
+            )
+            self.date = date
+
+        seconds = int(time[0:2]) * 3600 + int(time[2:4]) * 60 + int(time[4:6])
+
+        return (self.midnight + timedelta(seconds=seconds)).astimezone(self.tz)
+
+
+class FixAssembler:
+    '''
+    A GPS receiver reports each position fix as a burst of sentences. Only GGA
+    and RMC carry the time of the fix, while GSA and VTG apply to the burst
+    they arrive in. This class merges the sentences of one fix into a single
+    dictionary, ready to be stored as one document.
+
+    A fix is complete when a GGA or RMC sentence arrives with a different
+    time. Fixes without a valid position are dropped.
+    '''
+
+    def __init__(self, timestamps):
+        self.timestamps = timestamps
+        self.date = None
+        self.time = None
+        self.fix = {}
+
+    def add(self, record):
+        '''
+        Merge a record into the current fix. Returns the previous fix when
+        this record starts a new one, otherwise None.
+        '''
+        completed = None
+        record_type = type(record)
+
+        if record_type is GGA or record_type is RMC:
+            if record.time != self.time:
+                completed = self.flush()
+                self.time = record.time
+
+        fix = self.fix
+
+        if record_type is GGA:
+            if record.fix_quality:
+                fix["latitude"] = record.latitude
+                fix["longitude"] = record.longitude
+                fix["fix_quality"] = record.fix_quality
+                fix["satellite_count"] = record.satellite_count
+                fix["hdop"] = record.hdop
+                if record.altitude is not None:
+                    fix["altitude"] = round(record.altitude * 3.28084, 3)
+                    fix["altitude_units"] = "ft"
+        elif record_type is RMC:
+            if record.date:
+                self.date = record.date
+            if record.status == "A":
+                fix["latitude"] = record.latitude
+                fix["longitude"] = record.longitude
+                fix["speed_knots"] = record.speed_knots
+                fix["track_angle"] = record.track_angle
+        elif record_type is GSA:
+            fix["fix_type"] = record.fix_type
+            fix["pdop"] = record.pdop
+            fix["hdop"] = record.hdop
+            fix["vdop"] = record.vdop
+        elif record_type is VTG:
+            fix["speed_knots"] = record.speed_knots
+            fix["speed_kph"] = record.speed_kph
+            if record.true_track is not None:
+                fix["track_angle"] = record.true_track
+
+        return completed
+
+    def flush(self):
+        '''
+        Return the current fix if it has a valid position, and start a new one
+        '''
+        fix = self.fix
+        self.fix = {}
+
+        if fix.get("latitude") is None:
+            return None
+
+        if self.date is not None and self.time:
+            fix["timestamp"] = self.timestamps.decode(self.time, self.date)
+
+        return fix
+
+
+class NMEAParser:
+    '''
+    Parses NMEA sentences from bytes as they arrive, in chunks of any size.
+
+    Every sentence's checksum is verified, and sentences that fail, or whose
+    fields can't be parsed, are counted and skipped. GSV data is spread over
+    several sentences, so a GSV record is only produced once all of the
+    sentences in a group have arrived in order.
+    '''
+
+    def __init__(self):
+        self.buffer = b""
+        self.gsv = {}
+
+        self.handlers = {
+            b"GGA": parse_gga,
+            b"RMC": parse_rmc,
+            b"GSA": parse_gsa,
+            b"VTG": parse_vtg,
+            b"GSV": self.parse_gsv
+        }
+
+        # counters that show how clean the incoming data is
+        self.sentences = 0
+        self.invalid = 0
+        self.unknown = 0
+
+    def feed(self, data):
+        '''
+        Add newly received bytes and yield a record for every complete
+        sentence that is now available
+        '''
+        lines = data.split(b"\n")
+
+        # only the first line continues what we already have
+        if self.buffer:
+            lines[0] = self.buffer + lines[0]
+
+        self.buffer = lines.pop()
+
+        if len(self.buffer) > MAX_LINE_LENGTH:
+            self.buffer = b""
+            self.invalid += 1
+
+        for line in lines:
+            record = self.parse(line)
+
+            if record is not None:
+                yield record
+
+    def parse(self, line):
+        start = line.find(b"$")
+        end = line.find(b"*", start)
+
+        if start == -1 or end == -1:
+            if line.strip():
+                self.invalid += 1
+            return None
+
+        body = line[start + 1:end]
+
+        try:
+            if int(line[end + 1:end + 3], 16) != checksum(body):
+                self.invalid += 1
+                return None
+        except ValueError:
+            self.invalid += 1
+            return None
+
+        self.sentences += 1
+
+        # proprietary sentences start with P and have no sentence type
+        # in the usual place
+        handler = self.handlers.get(body[2:5])
+
+        if handler is None or body[0:1] == b"P":
+            self.unknown += 1
+            return None
+
+        try:
+            fields = body.decode("ascii").split(",")
+
+            return handler(fields[0][0:2], fields)
+        except (ValueError, IndexError):
+            self.invalid += 1
+            return None
+
+    def parse_gsv(self, talker, fields):
+        count = int(fields[1])
+        number = int(fields[2])
+        satellites = parse_gsv_satellites(fields)
+
+        if number == 1:
+            self.gsv[talker] = satellites
+        elif talker in self.gsv and len(self.gsv[talker]) == 4 * (number - 1):
+            self.gsv[talker].extend(satellites)
+        else:
+            # we missed an earlier sentence in this group
+            self.gsv.pop(talker, None)
+            return None
+
+        if number == count:
+            return GSV(talker, to_int(fields[3]), tuple(self.gsv.pop(talker)))
+        else:
+            return None
+
+
+def read_records(source, parser=None, chunk_size=4096):
+    '''
+    Read records from a file-like object such as an open log file or a serial
+    port. For a serial port, we read whatever is waiting so we don't block
+    until a full chunk has arrived.
+    '''
+    if parser is None:
+        parser = NMEAParser()
+
+    while True:
+        if hasattr(source, "in_waiting"):
+            data = source.read(max(1, source.in_waiting))
+        else:
+            data = source.read(chunk_size)
+
+        if not data:
+            break
+
+        for record in parser.feed(data):
+            yield record
+
+
+if __name__ == "__main__":
+    pass